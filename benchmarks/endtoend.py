@@ -0,0 +1,212 @@
+"""Measure the extension end to end against the local mock Civitai API and Link server.
+
+Generates a small library (see tree.py), starts benchmarks/mock_api.py and benchmarks/mock_link.py in process, points
+the extension at them and times `load_info`, `load_previews`, `download_file` and a scripted stream of Link
+commands through `link.on_command`:
+
+    python benchmarks/endtoend.py --files 500 --latency 0.05 --error-rate 0.02 --rate-limit 50 --json e2e.json
+
+Each operation reports its wall time plus what the mock saw: requests per route, statuses (including the 429s
+and 500s it injected) and bytes sent.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, os.path.join(bench_dir, 'stubs'))
+
+import mock_api
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'civitai-e2e'), help='where to generate the library')
+    parser.add_argument('--files', type=int, default=500, help='local model files, all without info files and previews')
+    parser.add_argument('--known-fraction', type=float, default=0.8, help='share of local files the mock API knows')
+    parser.add_argument('--downloads', type=int, default=8, help='files for download_file and resources:add')
+    parser.add_argument('--download-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--lists', type=int, default=20, help='resources:list commands in the Link script')
+    parser.add_argument('--cancel-every', type=int, default=4, help='cancel every nth resources:add, 0 for none')
+    parser.add_argument('--link-script', help='JSON list of Link steps to run instead of the generated one')
+    parser.add_argument('--link-latency', type=float, default=0, help='seconds before every Link command')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory (runs every operation once more)')
+    parser.add_argument('--only', help='comma separated operation names to run')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--trace', help='record tracing spans and write them to this file as a Chrome trace')
+    parser.add_argument('--seed', type=int, default=0)
+    mock_api.add_fault_args(parser)
+    return parser.parse_args()
+
+args = parse_args()
+shutil.rmtree(args.root, ignore_errors=True)
+os.makedirs(args.root)
+os.environ['CIVITAI_BENCH_ROOT'] = args.root
+
+import civitai.cache as cache
+import civitai.index as index
+import civitai.lib as civitai
+import civitai.tracing as tracing
+import civitai.link as link
+from civitai.resources import ResourceSnapshot
+import scripts.info as info
+import scripts.previews as previews
+
+import measure
+import mock_link
+import tree
+
+#region State
+civitai.resource_index = index.ResourceIndex(os.path.join(args.root, 'index.json'))
+civitai.log = civitai.hash_queue.log = lambda message: None
+link.log = lambda message: None
+# Downloads should fail fast in a benchmark, not sit out the real backoff
+civitai.api_backoff = 0.05
+civitai.api_max_backoff = 1
+api_cache_path = os.path.join(args.root, 'api.json')
+
+def reset_api_cache():
+    if os.path.exists(api_cache_path): os.remove(api_cache_path)
+    civitai.api_cache = cache.ResponseCache(api_cache_path)
+
+def rescan():
+    civitai.resource_snapshot = ResourceSnapshot()
+    civitai.resources_loaded = False
+    return civitai.load_resource_list()
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path): os.remove(path)
+    rescan()
+#endregion
+
+#region Operations
+def with_api_stats(api, run):
+    """Run an operation and add what the mock API saw during it to its details."""
+    def measured():
+        api.stats.reset()
+        details = run() or {}
+        details['api'] = api.stats.to_dict()
+        return details
+    return measured
+
+def sidecars(exts):
+    return [os.path.splitext(r['path'])[0] + ext for r in rescan() for ext in exts]
+
+def op_load_info(api):
+    def setup():
+        remove_files(sidecars(['.json']))
+        reset_api_cache()
+
+    def run():
+        info.load_info()
+        return {'infoFiles': len([r for r in rescan() if r['hasInfo']])}
+    return {'setup': setup, 'run': with_api_stats(api, run)}
+
+def op_load_previews(api):
+    def setup():
+        remove_files(sidecars(civitai.preview_exts))
+        reset_api_cache()
+
+    def run():
+        previews.load_previews()
+        return {'previews': len([r for r in rescan() if r['hasPreview']])}
+    return {'setup': setup, 'run': with_api_stats(api, run)}
+
+def op_download_file(api, downloads):
+    dest_dir = os.path.join(args.root, 'downloads')
+    os.makedirs(dest_dir, exist_ok=True)
+
+    def teardown():
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.makedirs(dest_dir, exist_ok=True)
+
+    def run():
+        for resource in downloads:
+            civitai.download_file(resource['url'], os.path.join(dest_dir, resource['name']), hash=resource['hash'])
+        completed = [r for r in downloads if os.path.exists(os.path.join(dest_dir, r['name']))]
+        return {'files': len(completed), 'bytes': sum(os.path.getsize(os.path.join(dest_dir, r['name'])) for r in completed)}
+    return {'run': with_api_stats(api, run), 'teardown': teardown}
+
+def op_link_commands(api, server, downloads):
+    if args.link_script:
+        with open(args.link_script, 'r') as f:
+            steps = json.load(f)
+    else:
+        steps = mock_link.default_script(downloads, args.lists, args.cancel_every)
+    lora_dir = civitai.get_lora_dir()
+
+    def setup():
+        server.reset()
+        link.processing_activities.clear()
+        link.should_cancel_activity.clear()
+        link.keep_partial_activity.clear()
+
+    def teardown():
+        remove_files([os.path.join(lora_dir, r['name']) for r in downloads])
+
+    def run():
+        summary = server.run_script(steps)
+        if summary['timedOut']: raise TimeoutError('The Link commands did not all finish')
+        return summary
+    return {'setup': setup, 'run': with_api_stats(api, run), 'teardown': teardown}
+#endregion
+
+def main():
+    print(f'Generating {args.files} files in {args.root}')
+    tree.generate(civitai, args.files, 0, 0, tree.header_size, 0, 0, 1, args.seed)
+    rescan()
+
+    api = mock_api.MockCivitai(faults=mock_api.faults_from_args(args), known_fraction=args.known_fraction, seed=args.seed).start()
+    civitai.base_url = api.api_url
+    downloads = [api.catalog.add_file(f'e2e_lora_{i:04d}.safetensors', 'LORA', args.download_size) for i in range(args.downloads)]
+
+    server = mock_link.MockLink(latency=args.link_latency).start()
+    link.socketio_url = server.url
+    link.socketio_connect()
+    link.join_room('benchmark')
+    server.wait_for_client()
+
+    operations = [
+        ('load_info', lambda: op_load_info(api)),
+        ('load_previews', lambda: op_load_previews(api)),
+        ('download_file', lambda: op_download_file(api, downloads)),
+        ('link_commands', lambda: op_link_commands(api, server, downloads)),
+    ]
+    if args.only: operations = [op for op in operations if op[0] in args.only.split(',')]
+
+    if args.trace: tracing.set_enabled(True)
+    results = []
+    try:
+        for name, create in operations:
+            op = create()
+            result = measure.measure(name, op['run'], op.get('setup'), op.get('teardown'), args.repeat, args.memory)
+            results.append(result)
+            details = result.get('details', {})
+            statuses = ', '.join(f'{status}: {count}' for status, count in sorted(details.get('api', {}).get('statuses', {}).items()))
+            print(f"{name:>16}  {result['wall'] * 1000:10.1f}ms  requests {sum(details.get('api', {}).get('requests', {}).values()):>6}  ({statuses})")
+            if name == 'link_commands':
+                for type, entry in details['byType'].items():
+                    p50 = f"{entry['p50'] * 1000:.1f}ms" if entry['p50'] is not None else '-'
+                    p95 = f"{entry['p95'] * 1000:.1f}ms" if entry['p95'] is not None else '-'
+                    print(f"{'':>16}  {type:>18}  {entry['finished']}/{entry['sent']}  p50 {p50}  p95 {p95}  {entry['statuses']}")
+    finally:
+        link.sio.disconnect()
+        server.stop()
+        api.stop()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('json', 'only', 'trace')}
+    report = {'settings': settings, 'python': sys.version, 'platform': sys.platform, 'results': results}
+    if args.trace:
+        print(f"Wrote {tracing.export_chrome_trace(args.trace)} trace events to {args.trace}")
+        report['spans'] = tracing.get_summary()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compare the hashing strategies of civitai.hashes on synthetic files.
+
+Point --dir at the storage to tune for (a local NVMe drive, an NFS mount, ...):
+
+    python benchmarks/hashing.py --dir /mnt/models --size 4G --chunk-sizes 1M,8M,32M
+
+Files are dropped from the page cache before every run unless --warm is given, so the numbers reflect the
+storage rather than memory.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import civitai.hashes as hashing
+
+units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(value: str):
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units: return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def create_file(path: str, size: int):
+    if os.path.exists(path) and os.path.getsize(path) == size: return
+    block = os.urandom(16 * 1024 * 1024)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            count = min(len(block), size - written)
+            f.write(block[:count])
+            written += count
+
+def drop_cache(path: str):
+    if not hasattr(os, 'posix_fadvise'): return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where to create the test files')
+    parser.add_argument('--size', default='2G', help='size of each test file, e.g. 512M or 4G')
+    parser.add_argument('--files', type=int, default=1, help='number of test files')
+    parser.add_argument('--strategies', default=','.join(hashing.strategies))
+    parser.add_argument('--chunk-sizes', default='1M,8M,32M')
+    parser.add_argument('--algorithm', default='sha256')
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--warm', action='store_true', help="don't drop the files from the page cache between runs")
+    parser.add_argument('--keep', action='store_true', help='keep the test files for the next run')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    size = parse_size(args.size)
+    paths = [os.path.join(args.dir, f'civitai-hash-bench-{i}.bin') for i in range(args.files)]
+    print(f'Creating {args.files} x {args.size} test files in {args.dir}')
+    for path in paths: create_file(path, size)
+
+    results = []
+    try:
+        for strategy in args.strategies.split(','):
+            for chunk_size in [parse_size(c) for c in args.chunk_sizes.split(',')]:
+                speeds = []
+                for _ in range(args.repeat):
+                    for path in paths:
+                        cold = not args.warm and drop_cache(path)
+                        hashing.hash_file(path, args.algorithm, strategy, chunk_size)
+                        speeds.append(hashing.history[-1]['speed'])
+
+                result = {'strategy': strategy, 'chunkSize': chunk_size, 'algorithm': args.algorithm, 'cold': cold, 'bestSpeed': max(speeds), 'meanSpeed': sum(speeds) / len(speeds)}
+                results.append(result)
+                print(f"{strategy:>9} {chunk_size // 1024:>7} KB  best {result['bestSpeed'] / 1024 ** 2:8.1f} MB/s  mean {result['meanSpeed'] / 1024 ** 2:8.1f} MB/s")
+    finally:
+        if not args.keep:
+            for path in paths: os.remove(path)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'size': size, 'files': args.files, 'dir': args.dir, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Wall time, filesystem calls and memory for one benchmark operation."""
+import builtins
+import os
+import resource
+import time
+import tracemalloc
+
+# Filesystem calls made from Python. Calls made inside C code, like DirEntry.stat, aren't seen here but
+# show up in the read syscall counts from /proc on Linux.
+counted_functions = [(os, 'stat'), (os, 'lstat'), (os, 'scandir'), (os, 'listdir'), (os, 'open'), (builtins, 'open')]
+
+class FsCounter:
+    def __init__(self):
+        self.counts = {}
+        self.originals = []
+
+    def wrap(self, module, name):
+        original = getattr(module, name)
+        counts = self.counts
+        key = f'{module.__name__}.{name}'
+        counts[key] = 0
+
+        def counted(*args, **kwargs):
+            counts[key] += 1
+            return original(*args, **kwargs)
+        setattr(module, name, counted)
+        self.originals.append((module, name, original))
+
+    def __enter__(self):
+        for module, name in counted_functions: self.wrap(module, name)
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, original in reversed(self.originals): setattr(module, name, original)
+        self.originals = []
+
+def read_proc_io():
+    """Read and write syscall counts of this process, where /proc provides them."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            values = dict(line.split(': ') for line in f.read().splitlines())
+        return {'readSyscalls': int(values['syscr']), 'writeSyscalls': int(values['syscw'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def measure(name: str, run, setup=None, teardown=None, repeat: int = 1, memory: bool = True):
+    """Run `run` `repeat` times, each after `setup`, and report the best wall time plus counters from the first run.
+
+    Peak Python memory is measured in one extra run under tracemalloc, so tracing doesn't skew the timings.
+    """
+    timings = []
+    cpu_timings = []
+    result = {'name': name}
+    for i in range(repeat):
+        if setup is not None: setup()
+        io_before = read_proc_io()
+        with FsCounter() as counter:
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            value = run()
+            timings.append(time.perf_counter() - started)
+            cpu_timings.append(time.process_time() - cpu_started)
+        io_after = read_proc_io()
+        if teardown is not None: teardown()
+
+        if i == 0:
+            result['fsCalls'] = dict(counter.counts)
+            result['fsCallsTotal'] = sum(counter.counts.values())
+            if io_before is not None and io_after is not None:
+                result.update({key: io_after[key] - io_before[key] for key in io_before})
+            if isinstance(value, dict): result['details'] = value
+
+    result['wall'] = min(timings)
+    result['wallMean'] = sum(timings) / len(timings)
+    result['cpu'] = min(cpu_timings)
+    result['runs'] = repeat
+
+    if memory:
+        if setup is not None: setup()
+        tracemalloc.start()
+        try:
+            run()
+            result['peakMemory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        if teardown is not None: teardown()
+
+    result['maxRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
@@ -0,0 +1,414 @@
+"""Local stand-in for the parts of the Civitai API the extension uses, for load and regression testing.
+
+Serves `/api/v1/model-versions/by-hash` (batch and single), `/api/v1/model-versions/{id}`, ranged model downloads
+behind a redirect like the real site, and preview images. Latency, bandwidth, error rates and rate limiting (429s)
+are configurable, and every request is counted.
+
+Any SHA256 is known with probability --known-fraction, decided by the hash itself so answers are stable across
+runs. Downloadable files are added with `add_file` and serve deterministic content with a real SHA256.
+
+    python benchmarks/mock_api.py --port 8901 --latency 0.05 --error-rate 0.01 --rate-limit 20
+    python launch.py --civitai-endpoint http://127.0.0.1:8901/api/v1
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import socketserver
+import struct
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import civitai.ratelimit as ratelimit
+
+block_size = 64 * 1024
+base_models = ['SD 1.5', 'SD 2.1', 'SDXL 1.0']
+model_types = ['LORA', 'TextualInversion', 'Checkpoint', 'Hypernetwork', 'LoCon']
+
+class Faults:
+    """What makes the mock behave like a busy server.
+
+    `latency` and `jitter` are seconds before every response, `bandwidth` is bytes per second per response
+    (0 for unlimited), `error_rate` is the share of requests answered with a 500, `rate_limit` is requests per
+    second before answering 429 with Retry-After (0 for unlimited), and `drop_rate` is the share of file
+    responses cut off half way.
+    """
+    def __init__(self, latency: float = 0, jitter: float = 0, bandwidth: float = 0, error_rate: float = 0, rate_limit: float = 0, retry_after: float = 1, drop_rate: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+
+#region Content
+def png(width: int, height: int, seed: int):
+    """A solid colour PNG, enough for the preview transcoding to chew on."""
+    def chunk(kind: bytes, data: bytes):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    color = bytes([seed & 0xff, (seed >> 8) & 0xff, (seed >> 16) & 0xff])
+    rows = b''.join(b'\x00' + color * width for _ in range(height))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows, 9)) + chunk(b'IEND', b'')
+
+class FileContent:
+    """Deterministic file content: one pseudo-random block repeated up to `size` bytes."""
+    def __init__(self, name: str, size: int):
+        self.size = size
+        self.block = hashlib.shake_128(name.encode('utf8')).digest(block_size)
+        sha256 = hashlib.sha256()
+        for start in range(0, size, block_size): sha256.update(self.read(start, min(block_size, size - start)))
+        self.sha256 = sha256.hexdigest()
+
+    def read(self, start: int, length: int):
+        offset = start % block_size
+        data = self.block[offset:offset + length]
+        while len(data) < length: data += self.block[:length - len(data)]
+        return data
+#endregion
+
+#region Catalog
+class Catalog:
+    """The model versions the mock knows about, by id and by SHA256."""
+    def __init__(self, known_fraction: float = 0.8, seed: int = 0):
+        self.known_fraction = known_fraction
+        self.seed = seed
+        self.by_id = {}
+        self.by_hash = {}
+        self.files = {}
+        self.lock = threading.Lock()
+        self.base_url = ''
+
+    def is_known(self, hash: str):
+        value = int(hashlib.sha256(f'{self.seed}:{hash}'.encode('utf8')).hexdigest()[:8], 16)
+        return value / 0xffffffff < self.known_fraction
+
+    def create_version(self, hash: str, id: int, name: str, type: str, size: int, download_url: str = None):
+        rng = random.Random(hash)
+        file = {
+            'id': id,
+            'name': name,
+            'type': 'Model',
+            'primary': True,
+            'sizeKB': size / 1024,
+            'hashes': {'SHA256': hash.upper(), 'AutoV2': hash[:10].upper()},
+            'downloadUrl': download_url or f'{self.base_url}/api/download/models/{id}',
+        }
+        return {
+            'id': id,
+            'modelId': id // 2,
+            'name': f'v{rng.randint(1, 5)}.0',
+            'baseModel': rng.choice(base_models),
+            'description': f'<p>Mock model version {id}</p>' * rng.randint(1, 20),
+            'trainedWords': [f'word{rng.randint(0, 999)}' for _ in range(rng.randint(0, 4))],
+            'model': {'name': os.path.splitext(name)[0], 'type': type, 'nsfw': False},
+            'files': [file],
+            'images': [{
+                'url': f'{self.base_url}/images/{hash[:16]}/width=450/{id}.png',
+                'nsfw': i > 0 and rng.random() < 0.3,
+                'width': 512,
+                'height': 768,
+            } for i in range(rng.randint(1, 4))],
+            'downloadUrl': file['downloadUrl'],
+        }
+
+    def find_hash(self, hash: str):
+        hash = hash.lower()
+        with self.lock:
+            version = self.by_hash.get(hash)
+            if version is not None or not self.is_known(hash): return version
+
+            # Generated on first sight and remembered, so it can also be fetched by id
+            id = int(hash[:7], 16) + 1
+            rng = random.Random(hash)
+            type = rng.choice(model_types)
+            version = self.create_version(hash, id, f'{type.lower()}_{hash[:8]}.safetensors', type, rng.randint(1, 2000) * 1024 * 1024)
+            self.by_hash[hash] = version
+            self.by_id[id] = version
+            return version
+
+    def find_id(self, id: int):
+        with self.lock:
+            return self.by_id.get(id)
+
+    def add_file(self, name: str, type: str, size: int):
+        """Make a downloadable model version. Returns a ResourceRequest-like dict for resources:add."""
+        content = FileContent(name, size)
+        with self.lock:
+            id = 10000000 + len(self.files)
+            self.files[id] = content
+            version = self.create_version(content.sha256, id, name, type, size)
+            self.by_hash[content.sha256] = version
+            self.by_id[id] = version
+        return {'name': name, 'type': type, 'hash': content.sha256, 'url': version['downloadUrl'], 'previewImage': version['images'][0]['url']}
+#endregion
+
+#region Server
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.statuses = {}
+            self.bytes_sent = 0
+            self.started = time.time()
+
+    def record(self, route: str, status: int, sent: int):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes_sent += sent
+
+    def to_dict(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'statuses': dict(self.statuses), 'bytesSent': self.bytes_sent, 'elapsed': time.time() - self.started}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockServer'
+
+    routes = [
+        ('POST', re.compile(r'^/api/v1/model-versions/by-hash/?$'), 'by_hash_batch'),
+        ('GET', re.compile(r'^/api/v1/model-versions/by-hash/(?P<hash>[0-9a-fA-F]+)$'), 'by_hash'),
+        ('GET', re.compile(r'^/api/v1/model-versions/(?P<id>\d+)$'), 'version'),
+        ('GET', re.compile(r'^/api/download/models/(?P<id>\d+)$'), 'download'),
+        ('GET', re.compile(r'^/files/(?P<id>\d+)$'), 'file'),
+        ('GET', re.compile(r'^/images/(?P<key>\w+)/width=(?P<width>\d+)/(?P<name>[\w.]+)$'), 'image'),
+        ('GET', re.compile(r'^/_stats$'), 'stats'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method: str):
+        path = self.path.split('?', 1)[0]
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send_json(404, {'error': 'Not found'}, 'unknown')
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0)) if method == 'POST' else b''
+        if name != 'stats' and not self.apply_faults(name): return
+        getattr(self, f'route_{name}')(body=body, **match.groupdict())
+
+    def apply_faults(self, route: str):
+        faults = self.server.faults
+        if faults.latency > 0 or faults.jitter > 0: time.sleep(faults.latency + random.uniform(0, faults.jitter))
+        if not self.server.allow_request():
+            self.send_json(429, {'error': 'Too many requests'}, route, {'Retry-After': f'{faults.retry_after:g}'})
+            return False
+        if random.random() < faults.error_rate:
+            self.send_json(500, {'error': 'Internal server error'}, route)
+            return False
+        return True
+
+    def send(self, status: int, body: bytes, route: str, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items(): self.send_header(key, value)
+        self.end_headers()
+        self.write(body)
+        self.server.stats.record(route, status, len(body))
+
+    def send_json(self, status: int, value, route: str, headers: dict = None):
+        self.send(status, json.dumps(value).encode('utf8'), route, 'application/json', headers)
+
+    def write(self, data: bytes):
+        bandwidth = self.server.faults.bandwidth
+        if bandwidth <= 0: return self.wfile.write(data)
+
+        bucket = ratelimit.TokenBucket(bandwidth)
+        chunk = bucket.chunk_size(block_size)
+        for start in range(0, len(data), chunk):
+            bucket.consume(min(chunk, len(data) - start))
+            self.wfile.write(data[start:start + chunk])
+
+    def parse_range(self, total: int):
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if not match or (not match[1] and not match[2]): return None
+        if not match[1]: return max(0, total - int(match[2])), total - 1
+        start = int(match[1])
+        end = min(total - 1, int(match[2])) if match[2] else total - 1
+        return (start, end) if start <= end else None
+
+    def send_content(self, read, total: int, route: str, content_type: str, etag: str):
+        """Serve `read(start, length)` with single range support, like the storage behind the real downloads."""
+        byte_range = self.parse_range(total)
+        start, end = byte_range if byte_range is not None else (0, total - 1)
+        length = end - start + 1
+        drop = random.random() < self.server.faults.drop_rate and length > 1
+
+        self.send_response(206 if byte_range is not None else 200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if byte_range is not None: self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        self.end_headers()
+
+        sent = 0
+        limit = length // 2 if drop else length
+        while sent < limit:
+            count = min(block_size, limit - sent)
+            self.write(read(start + sent, count))
+            sent += count
+        if drop: self.close_connection = True
+        self.server.stats.record(route, 206 if byte_range is not None else 200, sent)
+
+    def route_by_hash_batch(self, body: bytes):
+        try:
+            hashes = json.loads(body)
+        except ValueError:
+            return self.send_json(400, {'error': 'Expected a JSON list of hashes'}, 'by-hash[]')
+        versions = [self.server.catalog.find_hash(h) for h in hashes if isinstance(h, str)]
+        self.send_json(200, [v for v in versions if v is not None], 'by-hash[]')
+
+    def route_by_hash(self, body: bytes, hash: str):
+        version = self.server.catalog.find_hash(hash)
+        if version is None: return self.send_json(404, {'error': f'Model not found'}, 'by-hash')
+
+        etag = f'"{version["id"]}"'
+        if self.headers.get('If-None-Match') == etag: return self.send(304, b'', 'by-hash', 'application/json', {'ETag': etag})
+        self.send_json(200, version, 'by-hash', {'ETag': etag})
+
+    def route_version(self, body: bytes, id: str):
+        version = self.server.catalog.find_id(int(id))
+        if version is None: return self.send_json(404, {'error': 'Model version not found'}, 'version')
+        self.send_json(200, version, 'version')
+
+    def route_download(self, body: bytes, id: str):
+        if int(id) not in self.server.catalog.files: return self.send_json(404, {'error': 'File not found'}, 'download')
+        # The real endpoint redirects to signed storage URLs
+        self.send(307, b'', 'download', 'text/plain', {'Location': f'{self.server.url}/files/{id}'})
+
+    def route_file(self, body: bytes, id: str):
+        content = self.server.catalog.files.get(int(id))
+        if content is None: return self.send_json(404, {'error': 'File not found'}, 'file')
+        self.send_content(content.read, content.size, 'file', 'application/octet-stream', f'"{content.sha256[:16]}"')
+
+    def route_image(self, body: bytes, key: str, width: str, name: str):
+        width = max(1, min(int(width), 1024))
+        data = png(width, width * 3 // 2, int(key[:6], 16) if re.match(r'^[0-9a-f]{6}', key) else 0)
+        self.send_content(lambda start, length: data[start:start + length], len(data), 'image', 'image/png', f'"{key}-{width}"')
+
+    def route_stats(self, body: bytes):
+        self.send_json(200, self.server.stats.to_dict(), 'stats')
+
+class MockServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, catalog: Catalog, faults: Faults):
+        super().__init__(address, Handler)
+        self.catalog = catalog
+        self.faults = faults
+        self.stats = Stats()
+        self.url = f'http://{self.server_address[0]}:{self.server_address[1]}'
+        self.rate_lock = threading.Lock()
+        self.rate_tokens = faults.rate_limit
+        self.rate_last = time.monotonic()
+        catalog.base_url = self.url
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on downloads they cancel or cut short
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+    def allow_request(self):
+        # Requests per second with up to a second of burst
+        rate = self.faults.rate_limit
+        if rate <= 0: return True
+        with self.rate_lock:
+            now = time.monotonic()
+            self.rate_tokens = min(rate, self.rate_tokens + (now - self.rate_last) * rate)
+            self.rate_last = now
+            if self.rate_tokens < 1: return False
+            self.rate_tokens -= 1
+            return True
+
+class MockCivitai:
+    """The mock API running on a background thread. `api_url` is what --civitai-endpoint should be set to."""
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, faults: Faults = None, known_fraction: float = 0.8, seed: int = 0):
+        self.catalog = Catalog(known_fraction, seed)
+        self.server = MockServer((host, port), self.catalog, faults or Faults())
+        self.thread = None
+
+    @property
+    def url(self):
+        return self.server.url
+
+    @property
+    def api_url(self):
+        return f'{self.server.url}/api/v1'
+
+    @property
+    def faults(self):
+        return self.server.faults
+
+    @property
+    def stats(self):
+        return self.server.stats
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+#endregion
+
+def add_fault_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0, help='seconds before every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra seconds of latency')
+    parser.add_argument('--bandwidth', type=float, default=0, help='bytes per second per response, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with a 500')
+    parser.add_argument('--rate-limit', type=float, default=0, help='requests per second before answering 429, 0 for unlimited')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of the 429s, in seconds')
+    parser.add_argument('--drop-rate', type=float, default=0, help='share of file responses cut off half way')
+
+def faults_from_args(args):
+    return Faults(args.latency, args.jitter, args.bandwidth, args.error_rate, args.rate_limit, args.retry_after, args.drop_rate)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--known-fraction', type=float, default=0.8, help='share of hashes the mock knows')
+    parser.add_argument('--files', type=int, default=10, help='downloadable files to create')
+    parser.add_argument('--file-size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+    add_fault_args(parser)
+    args = parser.parse_args()
+
+    mock = MockCivitai(args.host, args.port, faults_from_args(args), args.known_fraction, args.seed)
+    for i in range(args.files):
+        resource = mock.catalog.add_file(f'mock_lora_{i:04d}.safetensors', 'LORA', args.file_size)
+        print(json.dumps(resource))
+    print(f'Serving the mock Civitai API at {mock.api_url}, stats at {mock.url}/_stats')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Local stand-in for the Civitai Link server that sends scripted command streams to the extension.
+
+The extension connects like it does to the real server (point --civitai-link-endpoint at it), and the script's
+commands are sent to every connected webui. Each command is timed from sending it to its final `commandStatus`
+(success, error or canceled).
+
+A script is a JSON list of steps:
+
+    {"type": "resources:list"}                                  send a command, "repeat": n sends it n times
+    {"type": "resources:add", "resource": {...}}
+    {"type": "activities:cancel", "activityId": "$previous"}    $previous is the id of the command before
+    {"sleep": 0.5}                                              pause the script
+    {"await": true}                                             wait for every command sent so far to finish
+
+    python benchmarks/mock_link.py --port 8902 --script commands.json
+
+Runs python-socketio's ASGI server on uvicorn, both of which the webui already ships, so the extension talks to it
+over websockets like it does to the real server.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+import uuid
+from typing import List
+
+import socketio
+import uvicorn
+
+final_statuses = ['success', 'error', 'canceled']
+
+class CommandRecord:
+    def __init__(self, payload: dict):
+        self.id = payload['id']
+        self.type = payload['type']
+        self.sent = time.perf_counter()
+        self.first_update = None
+        self.finished = None
+        self.status = None
+        self.updates = 0
+        self.done = threading.Event()
+
+    def update(self, payload: dict):
+        now = time.perf_counter()
+        self.updates += 1
+        if self.first_update is None: self.first_update = now - self.sent
+        self.status = payload.get('status')
+        if self.status in final_statuses and not self.done.is_set():
+            self.finished = now - self.sent
+            self.done.set()
+
+class MockLink:
+    """The mock Link server running on a background thread. `latency` is seconds added before every message sent."""
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0):
+        self.latency = latency
+        self.sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+        self.app = socketio.ASGIApp(self.sio, socketio_path='api/socketio')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.url = f'http://{host}:{self.socket.getsockname()[1]}'
+        self.server = uvicorn.Server(uvicorn.Config(self.app, log_level='warning', lifespan='off'))
+        self.loop = None
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.joined = threading.Event()
+        self.commands = {}
+        self.order: List[CommandRecord] = []
+        self.lists_pushed = 0
+        self.list_sizes = []
+        self.register_events()
+
+    def register_events(self):
+        sio = self.sio
+
+        @sio.event
+        async def connect(sid, environ, auth=None):
+            with self.lock:
+                self.clients[sid] = None
+
+        @sio.event
+        async def disconnect(sid, *args):
+            with self.lock:
+                self.clients.pop(sid, None)
+
+        @sio.on('iam')
+        async def on_iam(sid, data):
+            with self.lock:
+                self.clients[sid] = data.get('type') if isinstance(data, dict) else data
+
+        @sio.on('join')
+        async def on_join(sid, key):
+            await sio.enter_room(sid, key)
+            # Pretend a browser is in the room, so the extension considers itself connected
+            await sio.emit('roomPresence', {'sd': 1, 'client': 1}, room=key)
+            self.joined.set()
+            return True
+
+        @sio.on('commandStatus')
+        async def on_command_status(sid, payload):
+            with self.lock:
+                record = self.commands.get(payload.get('id'))
+                if record is None and payload.get('type') == 'resources:list':
+                    # Sent on its own after downloads, removals and rescans
+                    self.lists_pushed += 1
+                    self.list_sizes.append(len(payload.get('resources', [])))
+                    return
+            if record is not None: record.update(payload)
+
+    def serve(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.server.serve(sockets=[self.socket]))
+        finally:
+            # Ping tasks of sockets the server didn't get to close
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks: task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        while not self.server.started and self.thread.is_alive(): time.sleep(0.01)
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.sio.shutdown(), self.loop).result(10)
+        self.server.should_exit = True
+        self.thread.join(10)
+
+    def wait_for_client(self, timeout: float = 30):
+        """Wait until a webui has connected and joined a room."""
+        if not self.joined.wait(timeout): raise TimeoutError('No webui joined the mock Link server')
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.order = []
+            self.lists_pushed = 0
+            self.list_sizes = []
+
+    #region Commands
+    def send_command(self, command: dict) -> CommandRecord:
+        payload = {**command, 'id': command.get('id') or str(uuid.uuid4()), 'createdAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        if self.latency > 0: time.sleep(self.latency)
+        record = CommandRecord(payload)
+        with self.lock:
+            self.commands[record.id] = record
+            self.order.append(record)
+            sids = [sid for sid, type in self.clients.items() if type == 'sd']
+        for sid in sids: asyncio.run_coroutine_threadsafe(self.sio.emit('command', payload, to=sid), self.loop).result()
+        return record
+
+    def wait(self, records: List[CommandRecord] = None, timeout: float = None):
+        """Wait for `records`, by default every command sent so far, to finish. Returns True if they all did."""
+        if records is None:
+            with self.lock:
+                records = list(self.order)
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        for record in records:
+            remaining = None if deadline is None else max(0, deadline - time.perf_counter())
+            if not record.done.wait(remaining): return False
+        return True
+
+    def run_script(self, steps: List[dict], timeout: float = 300):
+        """Send the commands of a script in order, wait for all of them to finish and return the summary."""
+        started = time.perf_counter()
+        previous = None
+        for step in steps:
+            if 'sleep' in step:
+                time.sleep(step['sleep'])
+                continue
+            if step.get('await'):
+                self.wait(timeout=timeout)
+                continue
+
+            command = {key: value for key, value in step.items() if key != 'repeat'}
+            for _ in range(step.get('repeat', 1)):
+                resolved = {key: (previous if value == '$previous' else value) for key, value in command.items()}
+                previous = self.send_command(resolved).id
+
+        finished = self.wait(timeout=timeout)
+        summary = self.summary(time.perf_counter() - started)
+        summary['timedOut'] = not finished
+        return summary
+    #endregion
+
+    def summary(self, elapsed: float):
+        def percentile(values, share):
+            return values[min(len(values) - 1, int(len(values) * share))] if values else None
+
+        with self.lock:
+            records = list(self.order)
+            lists_pushed = self.lists_pushed
+            list_sizes = list(self.list_sizes)
+
+        by_type = {}
+        for record in records:
+            entry = by_type.setdefault(record.type, {'sent': 0, 'finished': 0, 'statuses': {}, 'updates': 0, 'times': [], 'firstUpdates': []})
+            entry['sent'] += 1
+            entry['updates'] += record.updates
+            if record.finished is not None:
+                entry['finished'] += 1
+                entry['times'].append(record.finished)
+            if record.first_update is not None: entry['firstUpdates'].append(record.first_update)
+            if record.status is not None: entry['statuses'][record.status] = entry['statuses'].get(record.status, 0) + 1
+
+        for entry in by_type.values():
+            times = sorted(entry.pop('times'))
+            first_updates = sorted(entry.pop('firstUpdates'))
+            entry['mean'] = sum(times) / len(times) if times else None
+            entry['p50'] = percentile(times, 0.5)
+            entry['p95'] = percentile(times, 0.95)
+            entry['max'] = times[-1] if times else None
+            entry['firstUpdateP50'] = percentile(first_updates, 0.5)
+
+        return {
+            'elapsed': elapsed,
+            'commands': len(records),
+            'commandsPerSecond': len(records) / elapsed if elapsed > 0 else None,
+            'listsPushed': lists_pushed,
+            'listSizeMax': max(list_sizes) if list_sizes else 0,
+            'byType': by_type,
+        }
+
+def default_script(resources: List[dict], lists: int = 20, cancel_every: int = 0):
+    """Interleave resources:list commands with downloads of `resources`, canceling every `cancel_every`th one."""
+    groups = []
+    for i, resource in enumerate(resources):
+        group = [{'type': 'resources:add', 'resource': dict(resource)}]
+        if cancel_every > 0 and (i + 1) % cancel_every == 0: group.append({'type': 'activities:cancel', 'activityId': '$previous'})
+        groups.append(group)
+
+    steps = [{'type': 'activities:list'}]
+    list_every = max(1, len(groups) // max(1, lists))
+    for i, group in enumerate(groups):
+        if i % list_every == 0: steps.append({'type': 'resources:list'})
+        steps.extend(group)
+    steps.append({'await': True})
+    steps.append({'type': 'resources:list', 'repeat': lists})
+    return steps
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8902)
+    parser.add_argument('--latency', type=float, default=0, help='seconds before every command sent')
+    parser.add_argument('--script', help='JSON list of steps, by default a stream of resources:list commands')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    if args.script:
+        with open(args.script, 'r') as f:
+            steps = json.load(f)
+    else:
+        steps = default_script([])
+
+    link = MockLink(args.host, args.port, args.latency).start()
+    print(f'Mock Link server at {link.url}, waiting for the webui to join a room')
+    link.wait_for_client(timeout=None)
+    print(json.dumps(link.run_script(steps, args.timeout), indent=2))
+    link.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""Just enough of the webui `modules` package for civitai.lib and the scripts to import and run outside the webui.
+
+Paths live under the directory in the CIVITAI_BENCH_ROOT environment variable, set before importing anything.
+"""
+import os
+
+root = os.environ.get('CIVITAI_BENCH_ROOT', os.path.join(os.getcwd(), 'bench-root'))
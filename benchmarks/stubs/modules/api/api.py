@@ -0,0 +1,5 @@
+def encode_pil_to_base64(image):
+    raise NotImplementedError('Image generation is not available in the benchmarks')
+
+def validate_sampler_name(name):
+    return name
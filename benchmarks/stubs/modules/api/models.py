@@ -0,0 +1,7 @@
+class StableDiffusionTxt2ImgProcessingAPI:
+    def __init__(self, **kwargs):
+        raise NotImplementedError('Image generation is not available in the benchmarks')
+
+class TextToImageResponse:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
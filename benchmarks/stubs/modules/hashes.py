@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+
+from modules import root
+
+# Named unlike the old webui globals, so civitai.lib goes through dump_cache like on current webui versions
+cache_path = os.path.join(root, 'cache.json')
+data = None
+dumps = 0
+
+def cache(subsection):
+    global data
+    if data is None:
+        data = {}
+        if os.path.isfile(cache_path):
+            with open(cache_path, 'r', encoding='utf8') as f:
+                data = json.load(f)
+    return data.setdefault(subsection, {})
+
+def dump_cache():
+    global dumps
+    dumps += 1
+    with open(cache_path, 'w', encoding='utf8') as f:
+        json.dump(data, f)
+
+def calculate_sha256(filename):
+    hash_sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+def sha256_from_cache(filename, title, use_addnet_hash=False):
+    hashes = cache('hashes')
+    if title not in hashes: return None
+    if os.path.getmtime(filename) > hashes[title].get('mtime', 0): return None
+    return hashes[title].get('sha256')
+
+def sha256(filename, title, use_addnet_hash=False):
+    value = sha256_from_cache(filename, title)
+    if value is not None: return value
+    value = calculate_sha256(filename)
+    cache('hashes')[title] = {'mtime': os.path.getmtime(filename), 'sha256': value}
+    dump_cache()
+    return value
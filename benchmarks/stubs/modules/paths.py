@@ -0,0 +1,5 @@
+import os
+
+from modules import root
+
+models_path = os.path.join(root, 'models')
@@ -0,0 +1,6 @@
+class StableDiffusionProcessingTxt2Img:
+    def __init__(self, **kwargs):
+        raise NotImplementedError('Image generation is not available in the benchmarks')
+
+def process_images(p):
+    raise NotImplementedError('Image generation is not available in the benchmarks')
@@ -0,0 +1,8 @@
+def on_before_image_saved(callback):
+    pass
+
+def on_app_started(callback):
+    pass
+
+def on_ui_settings(callback):
+    pass
@@ -0,0 +1,12 @@
+import os
+
+from modules.paths import models_path
+
+model_path = os.path.join(models_path, 'Stable-diffusion')
+checkpoints_list = {}
+
+def list_models():
+    pass
+
+def load_model(info):
+    pass
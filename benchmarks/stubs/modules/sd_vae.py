@@ -0,0 +1,9 @@
+import os
+
+from modules.paths import models_path
+
+vae_path = os.path.join(models_path, 'VAE')
+loaded_vae_file = None
+
+def get_filename(filepath):
+    return os.path.basename(filepath)
@@ -0,0 +1,27 @@
+import os
+import types
+
+from modules import root
+from modules.paths import models_path
+
+class Options:
+    def __init__(self):
+        self.data = {}
+
+    def save(self, filename):
+        pass
+
+opts = Options()
+cmd_opts = types.SimpleNamespace(
+    lora_dir=os.path.join(models_path, 'Lora'),
+    lyco_dir=os.path.join(models_path, 'LyCORIS'),
+    ckpt_dir=None,
+    hypernetwork_dir=os.path.join(models_path, 'hypernetworks'),
+    embeddings_dir=os.path.join(root, 'embeddings'),
+    no_hashing=False,
+)
+config_filename = os.path.join(root, 'config.json')
+sd_model = None
+
+def reload_hypernetworks():
+    pass
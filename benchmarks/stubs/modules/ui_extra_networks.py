@@ -0,0 +1 @@
+extra_pages = []
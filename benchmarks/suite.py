@@ -0,0 +1,243 @@
+"""Benchmark the resource scanning, lookup, hashing and hashification paths of the extension on a synthetic library.
+
+The webui isn't needed, benchmarks/stubs provides the `modules` it imports. A library of --files model files is
+generated under --root (kept for the next run with the same settings), then each operation is timed:
+
+    python benchmarks/suite.py --files 20000 --json results.json
+    python benchmarks/suite.py --files 20000 --compare results.json
+
+Every operation reports its wall and CPU time, the filesystem calls made from Python, read/write syscalls
+(Linux), and peak Python memory.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import types
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, os.path.join(bench_dir, 'stubs'))
+
+def parse_size(value: str):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units: return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'civitai-bench'), help='where to generate the library')
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--big-fraction', type=float, default=0.02, help='share of multi-GB (sparse) files')
+    parser.add_argument('--big-size', default='4G')
+    parser.add_argument('--small-size', default='128M', help='size of the other (sparse) model files')
+    parser.add_argument('--preview-fraction', type=float, default=0.6)
+    parser.add_argument('--info-fraction', type=float, default=0.4)
+    parser.add_argument('--hashed-fraction', type=float, default=0.95, help='share of files already in the webui hash cache')
+    parser.add_argument('--changes', type=int, default=100, help='files added before the rescan-after-changes run')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--images', type=int, default=200, help='saved images for add_resource_hashes')
+    parser.add_argument('--prompts', type=int, default=20, help='distinct prompts among the saved images')
+    parser.add_argument('--hash-sample', type=int, default=0, help='new files to fully hash with ensure_hashes (reads them completely)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--only', help='comma separated operation names to run')
+    parser.add_argument('--fresh', action='store_true', help='regenerate the library even if one exists')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--trace', help='record tracing spans and write them to this file as a Chrome trace')
+    parser.add_argument('--compare', help='compare with the results in this file')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+args = parse_args()
+os.environ['CIVITAI_BENCH_ROOT'] = args.root
+settings = {key: getattr(args, key) for key in ['files', 'big_fraction', 'big_size', 'small_size', 'preview_fraction', 'info_fraction', 'hashed_fraction', 'seed']}
+settings_path = os.path.join(args.root, 'settings.json')
+if args.fresh or not os.path.isfile(settings_path) or json.load(open(settings_path)) != settings:
+    shutil.rmtree(args.root, ignore_errors=True)
+os.makedirs(args.root, exist_ok=True)
+
+from modules import sd_models
+import civitai.index as index
+import civitai.lib as civitai
+import civitai.tracing as tracing
+from civitai.resources import ResourceSnapshot
+import scripts.gen_hashing as gen_hashing
+
+import measure
+import tree
+
+#region State
+index_path = os.path.join(args.root, 'index.json')
+civitai.api_cache.path = os.path.join(args.root, 'api.json')
+civitai.log = civitai.hash_queue.log = lambda message: None
+
+def reset(keep_index_file=False):
+    """Forget everything in memory, like a webui restart. The index file on disk is kept if asked."""
+    if not keep_index_file and os.path.exists(index_path): os.remove(index_path)
+    civitai.resource_index = index.ResourceIndex(index_path)
+    civitai.resource_snapshot = ResourceSnapshot()
+    civitai.resources_loaded = False
+    civitai.unhashed.clear()
+    gen_hashing.prompt_matcher = None
+    gen_hashing.memo.clear()
+
+def load_library():
+    manifest_path = os.path.join(args.root, 'manifest.json')
+    manifest = tree.load_manifest(manifest_path)
+    if manifest is not None: return manifest
+
+    print(f'Generating {args.files} files in {args.root}')
+    manifest = tree.generate(civitai, args.files, args.big_fraction, parse_size(args.big_size), parse_size(args.small_size), args.preview_fraction, args.info_fraction, args.hashed_fraction, args.seed)
+    tree.save_manifest(manifest_path, manifest)
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f)
+    return manifest
+#endregion
+
+#region Operations
+def op_scan_cold():
+    return {'setup': lambda: reset(), 'run': lambda: {'resources': len(civitai.load_resource_list())}}
+
+def op_scan_restart():
+    def setup():
+        reset()
+        civitai.load_resource_list()
+        reset(keep_index_file=True)
+    return {'setup': setup, 'run': lambda: {'resources': len(civitai.load_resource_list())}}
+
+def op_scan_warm():
+    return {'run': lambda: {'resources': len(civitai.load_resource_list())}}
+
+def op_scan_after_changes():
+    rng = random.Random(args.seed)
+    folders = tree.get_folders(civitai)
+    added = []
+
+    def setup():
+        for i in range(args.changes):
+            type = rng.choice(['LORA', 'TextualInversion', 'Checkpoint'])
+            path = os.path.join(folders[type], f'added_{i:05d}.{tree.type_exts[type]}')
+            tree.write_model(path, tree.header_size, rng)
+            added.append(path)
+
+    def teardown():
+        for path in added: os.remove(path)
+        added.clear()
+        civitai.load_resource_list()
+    return {'setup': setup, 'run': lambda: {'resources': len(civitai.load_resource_list())}, 'teardown': teardown}
+
+def op_get_resources_in_folder():
+    type, folder, exts, exts_exclude = [f for f in civitai.get_resource_folders() if f[0] == 'LORA'][0]
+    return {'run': lambda: {'resources': len(civitai.get_resources_in_folder(type, folder, exts, exts_exclude))}}
+
+def op_get_resource_by_hash(manifest):
+    rng = random.Random(args.seed)
+    known = [f['hash'] for f in manifest if f['hash'] is not None]
+    hashes = [rng.choice(known) for _ in range(args.lookups)]
+
+    def run():
+        found = sum(1 for hash in hashes if civitai.get_resource_by_hash(hash) is not None)
+        return {'lookups': len(hashes), 'found': found}
+    return {'run': run}
+
+def op_get_model_by_hash(manifest):
+    checkpoints = [f for f in manifest if f['type'] == 'Checkpoint' and f['hash'] is not None]
+    sd_models.checkpoints_list = {f['name']: types.SimpleNamespace(title=f['name'], sha256=f['hash'], shorthash=f['hash'][:10], hash=f['hash'][:8]) for f in checkpoints}
+    rng = random.Random(args.seed)
+    hashes = [rng.choice([f['hash'], f['hash'][:10], f['hash'][:8]]) for f in rng.choices(checkpoints, k=args.lookups)] if checkpoints else []
+
+    def run():
+        found = sum(1 for hash in hashes if civitai.get_model_by_hash(hash) is not None)
+        return {'lookups': len(hashes), 'found': found}
+    return {'run': run}
+
+def op_add_resource_hashes(manifest):
+    rng = random.Random(args.seed)
+    embeddings = [f['name'] for f in manifest if f['type'] == 'TextualInversion']
+    loras = [f['name'] for f in manifest if f['type'] == 'LORA']
+    checkpoints = [f['hash'][:10] for f in manifest if f['type'] == 'Checkpoint' and f['hash'] is not None] or ['0123456789']
+
+    prompts = []
+    for _ in range(args.prompts):
+        words = ['masterpiece', 'best quality', 'portrait', 'landscape', 'detailed', '(sharp focus:1.2)']
+        parts = rng.sample(words, 3) + rng.sample(embeddings, min(2, len(embeddings))) + [f'<lora:{name}:0.8>' for name in rng.sample(loras, min(3, len(loras)))]
+        rng.shuffle(parts)
+        negative = ', '.join(['lowres', 'bad anatomy'] + rng.sample(embeddings, min(1, len(embeddings))))
+        prompts.append((', '.join(parts), negative, rng.choice(checkpoints)))
+    images = [prompts[i % len(prompts)] for i in range(args.images)]
+
+    def setup():
+        gen_hashing.prompt_matcher = None
+        gen_hashing.memo.clear()
+        gen_hashing.memo_hits = gen_hashing.memo_misses = 0
+
+    def run():
+        for i, (prompt, negative, model_hash) in enumerate(images):
+            params = types.SimpleNamespace(pnginfo={'parameters': f'{prompt}\nNegative prompt: {negative}\nSteps: 20, Seed: {i}, Model hash: {model_hash}'})
+            gen_hashing.add_resource_hashes(params)
+        return {'images': len(images), 'memo': gen_hashing.get_memo_stats()}
+    return {'setup': setup, 'run': run}
+
+def op_ensure_hashes():
+    def run():
+        pending = civitai.get_resources().lookup.find_pending()[:args.hash_sample]
+        hashed = civitai.ensure_hashes(pending)
+        return {'files': len(hashed), 'bytes': sum(os.path.getsize(r.path) for r in hashed)}
+    # Hashed files leave the pending set, so every run starts from a fresh scan
+    return {'setup': lambda: (reset(), civitai.load_resource_list()), 'run': run}
+#endregion
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print(f'\nCompared with {baseline_path}:')
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None: continue
+        ratio = result['wall'] / before['wall'] if before['wall'] > 0 else float('inf')
+        print(f"{result['name']:>24}  {before['wall'] * 1000:10.1f} ms -> {result['wall'] * 1000:10.1f} ms  ({ratio:.2f}x)")
+
+def main():
+    manifest = load_library()
+    reset()
+    civitai.load_resource_list()
+
+    operations = [
+        ('scan_cold', lambda: op_scan_cold()),
+        ('scan_restart', lambda: op_scan_restart()),
+        ('scan_warm', lambda: op_scan_warm()),
+        ('scan_after_changes', lambda: op_scan_after_changes()),
+        ('get_resources_in_folder', lambda: op_get_resources_in_folder()),
+        ('get_resource_by_hash', lambda: op_get_resource_by_hash(manifest)),
+        ('get_model_by_hash', lambda: op_get_model_by_hash(manifest)),
+        ('add_resource_hashes', lambda: op_add_resource_hashes(manifest)),
+    ]
+    if args.hash_sample > 0: operations.append(('ensure_hashes', lambda: op_ensure_hashes()))
+    if args.only: operations = [op for op in operations if op[0] in args.only.split(',')]
+
+    if args.trace: tracing.set_enabled(True)
+    results = []
+    print(f"{'operation':>24}  {'wall':>10}  {'cpu':>10}  {'fs calls':>9}  {'read sc':>9}  {'peak mem':>9}")
+    for name, create in operations:
+        op = create()
+        result = measure.measure(name, op['run'], op.get('setup'), op.get('teardown'), args.repeat, not args.no_memory)
+        results.append(result)
+        peak = f"{result['peakMemory'] / 1024 ** 2:7.1f}MB" if 'peakMemory' in result else '-'
+        print(f"{name:>24}  {result['wall'] * 1000:8.1f}ms  {result['cpu'] * 1000:8.1f}ms  {result['fsCallsTotal']:>9}  {result.get('readSyscalls', '-'):>9}  {peak:>9}")
+
+    report = {'settings': settings, 'python': sys.version, 'platform': sys.platform, 'results': results}
+    if args.trace:
+        print(f"Wrote {tracing.export_chrome_trace(args.trace)} trace events to {args.trace}")
+        report['spans'] = tracing.get_summary()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare: compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Synthetic model library for the benchmarks: a webui-like folder tree with model files and sidecars."""
+import hashlib
+import json
+import os
+import random
+
+# Share of the library per resource type, roughly what large collections look like
+type_weights = {
+    'LORA': 50,
+    'TextualInversion': 25,
+    'Checkpoint': 8,
+    'LoCon': 6,
+    'Hypernetwork': 4,
+    'Controlnet': 4,
+    'VAE': 3,
+}
+type_exts = {
+    'LORA': 'safetensors',
+    'TextualInversion': 'pt',
+    'Checkpoint': 'safetensors',
+    'LoCon': 'safetensors',
+    'Hypernetwork': 'pt',
+    'Controlnet': 'safetensors',
+    'VAE': 'vae.pt',
+}
+files_per_dir = 200
+header_size = 4096
+
+def get_folders(civitai):
+    return {type: folder for type, folder, _, _ in civitai.get_resource_folders() if type in type_weights}
+
+def write_model(path: str, size: int, rng: random.Random):
+    # Random header so every file fingerprints differently, the rest is a hole that takes no disk space
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(min(header_size, size)))
+        if size > header_size: f.truncate(size)
+
+def generate(civitai, files: int, big_fraction: float, big_size: int, small_size: int, preview_fraction: float, info_fraction: float, hashed_fraction: float, seed: int = 0):
+    """Create `files` model files under the resource folders and return a manifest of them.
+
+    `hashed_fraction` of the files get an entry in the webui hash cache, the rest are new to the extension.
+    """
+    from modules import hashes
+
+    rng = random.Random(seed)
+    folders = get_folders(civitai)
+    types = list(type_weights)
+    weights = [type_weights[t] for t in types]
+    counters = {type: 0 for type in types}
+    cache = hashes.cache('hashes')
+    manifest = []
+
+    for i in range(files):
+        type = rng.choices(types, weights)[0]
+        index = counters[type]
+        counters[type] += 1
+
+        # A couple of levels of subfolders, like libraries sorted by base model and creator
+        dir = os.path.join(folders[type], f'group{index // (files_per_dir * 10)}', f'set{index // files_per_dir}')
+        os.makedirs(dir, exist_ok=True)
+        name = f'{type.lower()}_{index:06d}'
+        path = os.path.join(dir, f'{name}.{type_exts[type]}')
+
+        size = big_size if rng.random() < big_fraction else (header_size if type == 'TextualInversion' else small_size)
+        write_model(path, size, rng)
+        if rng.random() < preview_fraction: open(os.path.join(dir, f'{name}.preview.png'), 'wb').close()
+        if rng.random() < info_fraction: open(os.path.join(dir, f'{name}.json'), 'wb').close()
+
+        sha256 = hashlib.sha256(path.encode('utf8')).hexdigest()
+        hashed = rng.random() < hashed_fraction
+        if hashed:
+            title = f'{civitai.get_automatic_type(type)}/{civitai.get_automatic_name(type, path, folders[type])}'
+            cache[title] = {'mtime': os.path.getmtime(path), 'sha256': sha256}
+        manifest.append({'type': type, 'name': os.path.splitext(os.path.basename(path))[0], 'path': path, 'hash': sha256 if hashed else None, 'size': size})
+
+    hashes.dump_cache()
+    return manifest
+
+def save_manifest(path: str, manifest):
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(manifest, f)
+
+def load_manifest(path: str):
+    if not os.path.isfile(path): return None
+    with open(path, 'r', encoding='utf8') as f:
+        return json.load(f)
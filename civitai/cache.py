@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """Persistent, size-bounded LRU cache of API responses.
+
+    Entries are stored as {'value', 'expires', 'etag', 'size'}. A value of None is a negative entry, recording
+    that the API didn't know the key. Expired entries are kept until evicted so they can be revalidated with their ETag.
+    """
+    def __init__(self, path: str, max_entries: int = 20000, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        with self.lock:
+            if self.loaded: return
+            self.loaded = True
+            if not os.path.isfile(self.path): return
+            try:
+                with open(self.path, 'r', encoding='utf8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return
+            # Saved least recently used first, so insertion order restores the LRU order
+            for key, entry in data.get('entries', []):
+                self.entries[key] = entry
+                self.total_bytes += entry.get('size', 0)
+
+    def get(self, key: str):
+        """The entry for `key`, fresh or not, or None."""
+        self.load()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None: self.entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry):
+        return entry is not None and entry['expires'] > time.time()
+
+    def put(self, key: str, value, ttl: float, etag: str = None):
+        self.load()
+        size = len(json.dumps(value))
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None: self.total_bytes -= old.get('size', 0)
+            self.entries[key] = {'value': value, 'expires': time.time() + ttl, 'etag': etag, 'size': size}
+            self.total_bytes += size
+            self.evict()
+            self.dirty = True
+
+    def refresh(self, key: str, ttl: float):
+        """Extend an entry the server told us is still valid."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: return
+            entry['expires'] = time.time() + ttl
+            self.entries.move_to_end(key)
+            self.dirty = True
+
+    def evict(self):
+        # Must be called with the lock held
+        while len(self.entries) > 0 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.get('size', 0)
+
+    def flush(self):
+        """Write the cache to disk if anything changed."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty: return
+                data = {'entries': [(key, dict(entry)) for key, entry in self.entries.items()]}
+                self.dirty = False
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,371 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+import requests
+
+#region shared variables
+chunk_size = 1024 * 1024
+segment_size = 16 * 1024 * 1024
+min_segmented_size = 2 * segment_size
+segment_retries = 3
+progress_interval = 0.25
+state_save_interval = 2
+timeout = 30
+
+# Values `on_progress` can return to stop a download
+CANCEL = True
+CANCEL_KEEP_PARTIAL = 'keep-partial'
+#endregion
+
+class DownloadCancelled(Exception):
+    def __init__(self, keep_partial=False):
+        super().__init__('Download cancelled')
+        self.keep_partial = keep_partial
+
+class DownloadError(Exception):
+    pass
+
+#region Remote
+class RemoteFile:
+    """What we learned about a download target from the initial request."""
+    def __init__(self, url: str, total: int, accepts_ranges: bool, etag: str = None, last_modified: str = None):
+        self.url = url
+        self.total = total
+        self.accepts_ranges = accepts_ranges
+        self.etag = etag
+        self.last_modified = last_modified
+
+def parse_content_range(value: str):
+    # "bytes 0-0/1234" -> 1234, "bytes 0-0/*" -> 0
+    if not value or '/' not in value: return 0
+    total = value.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else 0
+
+def probe(url: str, headers: dict, ranged=True):
+    """Open the download with a one byte range request to find out if the server can serve segments.
+
+    Returns the RemoteFile and, when the server ignored the range, the open response so it can be streamed as-is.
+    Without `ranged` the plain request is made and always returned for streaming.
+    """
+    if ranged: headers = {**headers, 'Range': 'bytes=0-0'}
+    response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+    response.raise_for_status()
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 206:
+        total = parse_content_range(response.headers.get('Content-Range'))
+        response.close()
+        # Segment requests go straight to the final (usually signed storage) URL to skip the redirect
+        return RemoteFile(response.url, total, total > 0, etag, last_modified), None
+
+    total = int(response.headers.get('content-length', 0))
+    return RemoteFile(response.url, total, False, etag, last_modified), response
+#endregion
+
+#region Partial State
+class PartialState:
+    """Sidecar describing a partially downloaded file so the download can be resumed later."""
+    def __init__(self, url: str, hash: str = None, etag: str = None, last_modified: str = None, total: int = 0, completed: List[List[int]] = None):
+        self.url = url
+        self.hash = hash
+        self.etag = etag
+        self.last_modified = last_modified
+        self.total = total
+        self.completed = completed or []
+
+    def matches(self, url: str, hash: str, remote: RemoteFile):
+        same_target = self.url == url or (hash is not None and self.hash is not None and self.hash.lower() == hash.lower())
+        if not same_target or self.total != remote.total: return False
+        # Only compare validators the server gave us both times
+        if self.etag and remote.etag and self.etag != remote.etag: return False
+        if self.last_modified and remote.last_modified and self.last_modified != remote.last_modified: return False
+        return True
+
+    def completed_bytes(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'url': self.url,
+                'hash': self.hash,
+                'etag': self.etag,
+                'lastModified': self.last_modified,
+                'total': self.total,
+                'completed': self.completed,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str):
+        if not os.path.isfile(path): return None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return PartialState(data['url'], data.get('hash'), data.get('etag'), data.get('lastModified'), data.get('total', 0), data.get('completed', []))
+        except (OSError, ValueError, KeyError):
+            return None
+
+def state_path_for(path: str):
+    return path + '.json'
+
+def remove_partial(path: str):
+    for p in [path, state_path_for(path)]:
+        if os.path.exists(p): os.remove(p)
+#endregion
+
+#region Hashing
+class PrefixHasher:
+    """Hash the contiguous downloaded prefix of a file as it grows.
+
+    Data that arrives in order is hashed straight from memory, data written by the ranged workers is read back
+    while it's still in the page cache once everything before it has arrived.
+    """
+    def __init__(self, path: str, hasher):
+        self.path = path
+        self.hasher = hasher
+        self.position = 0
+
+    def update(self, data: bytes):
+        self.hasher.update(data)
+        self.position += len(data)
+
+    def update_to(self, end: int):
+        if end <= self.position: return
+        with open(self.path, 'rb') as f:
+            f.seek(self.position)
+            while self.position < end:
+                data = f.read(min(chunk_size, end - self.position))
+                if not data: raise DownloadError(f'Unexpected end of file while hashing {self.path}')
+                self.update(data)
+#endregion
+
+#region Segments
+class Segment:
+    def __init__(self, index: int, start: int, end: int):
+        self.index = index
+        self.start = start
+        self.end = end # inclusive
+        self.received = 0
+
+    @property
+    def size(self):
+        return self.end - self.start + 1
+
+    @property
+    def done(self):
+        return self.received >= self.size
+
+def split_segments(total: int, size: int = None) -> List[Segment]:
+    if size is None: size = segment_size
+    return [Segment(i, start, min(start + size, total) - 1) for i, start in enumerate(range(0, total, size))]
+
+def apply_completed(segments: List[Segment], completed: List[List[int]]):
+    """Mark the prefix of each segment that is covered by a completed range as received."""
+    for segment in segments:
+        for start, end in completed:
+            if start <= segment.start + segment.received <= end:
+                segment.received = min(end, segment.end) - segment.start + 1
+
+def contiguous_end(segments: List[Segment]):
+    """Offset up to which every byte of the file has been received."""
+    for segment in segments:
+        if not segment.done: return segment.start + segment.received
+    return segments[-1].end + 1 if len(segments) > 0 else 0
+
+def completed_ranges(segments: List[Segment]):
+    ranges = []
+    for segment in segments:
+        if segment.received == 0: continue
+        end = segment.start + segment.received - 1
+        if len(ranges) > 0 and ranges[-1][1] + 1 == segment.start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([segment.start, end])
+    return ranges
+#endregion
+
+#region Download
+class SegmentedDownload:
+    """Fetch a file over several ranged connections, writing each segment at its offset in `path`.
+
+    Segments are handed out lowest offset first so the completed prefix of the file grows steadily.
+    """
+    def __init__(self, remote: RemoteFile, path: str, connections: int = 4, headers: dict = None, state: PartialState = None, hasher=None, limiter=None):
+        self.remote = remote
+        self.path = path
+        self.connections = max(1, connections)
+        self.headers = headers or {}
+        self.state = state
+        self.hasher = PrefixHasher(path, hasher) if hasher is not None else None
+        self.limiter = limiter
+        self.segments = split_segments(remote.total)
+        if state is not None: apply_completed(self.segments, state.completed)
+        self.current = sum(s.received for s in self.segments)
+        self.error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.next_segment = 0
+
+    def take_segment(self):
+        with self.lock:
+            while self.next_segment < len(self.segments):
+                segment = self.segments[self.next_segment]
+                self.next_segment += 1
+                if not segment.done: return segment
+            return None
+
+    def add_received(self, segment: Segment, count: int):
+        with self.lock:
+            segment.received += count
+            self.current += count
+
+    def update_hash(self):
+        if self.hasher is None: return
+        with self.lock:
+            end = contiguous_end(self.segments)
+        self.hasher.update_to(end)
+
+    def save_state(self):
+        if self.state is None: return
+        with self.lock:
+            self.state.completed = completed_ranges(self.segments)
+        self.state.save(state_path_for(self.path))
+
+    def fetch_segment(self, session: requests.Session, f, segment: Segment):
+        start = segment.start + segment.received
+        headers = {**self.headers, 'Range': f'bytes={start}-{segment.end}'}
+        with session.get(self.remote.url, stream=True, headers=headers, timeout=timeout) as response:
+            if response.status_code != 206:
+                raise DownloadError(f'Expected partial content for range {start}-{segment.end}, got {response.status_code}')
+            f.seek(start)
+            read_size = self.limiter.chunk_size(chunk_size) if self.limiter is not None else chunk_size
+            for data in response.iter_content(chunk_size=read_size):
+                if self.stop_event.is_set(): return
+                if self.limiter is not None: self.limiter.consume(len(data))
+                # Never write past the segment, some servers ignore the end of the range
+                data = data[:segment.size - segment.received]
+                f.write(data)
+                # Flush before counting the bytes so the saved state never claims data that isn't in the file
+                f.flush()
+                self.add_received(segment, len(data))
+                if segment.done: break
+        if not segment.done and not self.stop_event.is_set():
+            raise DownloadError(f'Connection closed early for range {start}-{segment.end}')
+
+    def worker(self):
+        session = requests.Session()
+        try:
+            with open(self.path, 'r+b') as f:
+                while not self.stop_event.is_set():
+                    segment = self.take_segment()
+                    if segment is None: return
+
+                    attempt = 0
+                    while True:
+                        try:
+                            self.fetch_segment(session, f, segment)
+                            break
+                        except (requests.RequestException, DownloadError):
+                            attempt += 1
+                            if attempt > segment_retries or self.stop_event.is_set(): raise
+                            time.sleep(attempt)
+        except BaseException as e:
+            if self.error is None: self.error = e
+            self.stop_event.set()
+        finally:
+            session.close()
+
+    def run(self, on_progress: Callable[[int, int], bool] = None):
+        with open(self.path, 'ab') as f:
+            f.truncate(self.remote.total)
+
+        remaining = [s for s in self.segments if not s.done]
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(min(self.connections, len(remaining)))]
+        for w in workers: w.start()
+
+        cancelled = None
+        last_save = time.time()
+        # Only report once data arrived, callers work out speeds from it
+        reported = self.current
+        try:
+            while True:
+                alive = [w for w in workers if w.is_alive()]
+                if len(alive) == 0: break
+                alive[0].join(progress_interval)
+
+                if cancelled is None and self.error is None: self.update_hash()
+                if time.time() - last_save > state_save_interval:
+                    self.save_state()
+                    last_save = time.time()
+
+                if on_progress is None or cancelled is not None or self.current == reported: continue
+                reported = self.current
+                result = on_progress(self.current, self.remote.total)
+                if result == CANCEL or result == CANCEL_KEEP_PARTIAL:
+                    cancelled = result
+                    self.stop_event.set()
+        finally:
+            # Workers may still be running if on_progress raised
+            self.stop_event.set()
+            for w in workers: w.join()
+            self.save_state()
+
+        if cancelled is not None: raise DownloadCancelled(cancelled == CANCEL_KEEP_PARTIAL)
+        if self.error is not None: raise self.error
+        self.update_hash()
+        if on_progress is not None: on_progress(self.current, self.remote.total)
+
+def stream_response(response: requests.Response, path: str, total: int, on_progress: Callable[[int, int], bool] = None, hasher=None, limiter=None):
+    """Single connection fallback for servers that don't support ranges. These downloads can't be resumed."""
+    current = 0
+    read_size = limiter.chunk_size(chunk_size) if limiter is not None else chunk_size
+    with response, open(path, 'wb') as f:
+        for data in response.iter_content(chunk_size=read_size):
+            if limiter is not None: limiter.consume(len(data))
+            f.write(data)
+            if hasher is not None: hasher.update(data)
+            current += len(data)
+            if on_progress is None: continue
+            result = on_progress(current, total)
+            if result == CANCEL or result == CANCEL_KEEP_PARTIAL:
+                raise DownloadCancelled()
+
+def download(url: str, path: str, connections: int = 4, headers: dict = None, on_progress: Callable[[int, int], bool] = None, resume=False, hash: str = None, hasher=None, limiter=None):
+    """Download `url` into `path`, calling `on_progress(current, total)` as data arrives.
+
+    Returning CANCEL from `on_progress` stops the download, CANCEL_KEEP_PARTIAL stops it but keeps what was fetched.
+    With `resume`, progress is persisted next to `path` and a later call for the same url or hash continues from it.
+    A hashlib `hasher` is fed the file contents while downloading, a ratelimit.TokenBucket `limiter` caps its bandwidth.
+    A single connection without `resume` has no use for ranges, so it's one plain request (e.g. for previews).
+    """
+    headers = headers or {}
+    remote, response = probe(url, headers, ranged=connections > 1 or resume)
+
+    if not remote.accepts_ranges:
+        # A range answered without the file's size ("bytes 0-0/*") can't be split up, fetch the file whole instead
+        if response is None: remote, response = probe(url, headers, ranged=False)
+        # Nothing to resume from a server that can't serve ranges
+        remove_partial(path)
+        stream_response(response, path, remote.total, on_progress, hasher, limiter)
+        return remote
+
+    state = None
+    if resume:
+        state = PartialState.load(state_path_for(path))
+        if state is not None and os.path.isfile(path) and state.matches(url, hash, remote):
+            print(f'Civitai: Resuming download at {state.completed_bytes()} of {remote.total} bytes')
+        else:
+            remove_partial(path)
+            state = PartialState(url, hash, remote.etag, remote.last_modified, remote.total)
+
+    if remote.total < min_segmented_size: connections = 1
+    SegmentedDownload(remote, path, connections, headers, state, hasher, limiter).run(on_progress)
+    if state is not None and os.path.exists(state_path_for(path)): os.remove(state_path_for(path))
+    return remote
+#endregion
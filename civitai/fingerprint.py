@@ -0,0 +1,42 @@
+import hashlib
+import os
+import struct
+
+#region shared variables
+sample_size = 64 * 1024
+sample_count = 4
+# safetensors headers list every tensor's name, dtype, shape and offsets, which identifies a model well on its own
+max_header_size = 1024 * 1024
+#endregion
+
+def read_safetensors_header(f, size: int):
+    f.seek(0)
+    prefix = f.read(8)
+    if len(prefix) < 8: return None
+    length = struct.unpack('<Q', prefix)[0]
+    if length == 0 or length > size - 8: return None
+    return f.read(min(length, max_header_size))
+
+def fingerprint(path: str, size: int = None) -> str:
+    """A cheap identity for the file at `path`, from its size, safetensors header and a few sampled blocks.
+
+    Reads a few hundred KB at most, whatever the file size. Two files with the same fingerprint are treated as the
+    same file, it is not a substitute for the SHA256 Civitai knows a file by.
+    """
+    if size is None: size = os.path.getsize(path)
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(struct.pack('<Q', size))
+
+    with open(path, 'rb') as f:
+        if path.lower().endswith('.safetensors'):
+            header = read_safetensors_header(f, size)
+            if header is not None: hasher.update(header)
+
+        # Evenly spaced blocks from the start to the end of the file
+        step = max(size - sample_size, 0) / max(sample_count - 1, 1)
+        for i in range(sample_count):
+            f.seek(int(step * i))
+            hasher.update(f.read(sample_size))
+            if step == 0: break
+
+    return hasher.hexdigest()
@@ -1,58 +1,137 @@
-# from blake3 import blake3 as hasher
-import os.path
-
-from modules import hashes as sd_hashes
-
-# NOTE: About this file
-# ---------------------------------
-# This is not being used. It was added to see if Blake3 was faster than SHA256.
-# It was not noticeably faster in our tests, so we are sticking with SHA256 for now.
-# Especially since SHA256 is the standard inside this UI.
-
-# cache_key = "civitai_hashes"
-
-# def blake3_from_cache(filename, title):
-#     hashes = sd_hashes.cache(cache_key)
-#     ondisk_mtime = os.path.getmtime(filename)
-
-#     if title not in hashes:
-#         return None
-
-#     cached_blake3 = hashes[title].get("blake3", None)
-#     cached_mtime = hashes[title].get("mtime", 0)
-
-#     if ondisk_mtime > cached_mtime or cached_blake3 is None:
-#         return None
-
-#     return cached_blake3
-
-# def calculate_blake3(filename):
-#     hash_blake3 = hasher()
-#     blksize = 1024 * 1024
-
-#     with open(filename, "rb") as f:
-#         for chunk in iter(lambda: f.read(blksize), b""):
-#             hash_blake3.update(chunk)
-
-#     return hash_blake3.hexdigest()
-
-# def blake3(filename, title):
-#     hashes = sd_hashes.cache(cache_key)
-
-#     blake3_value = blake3_from_cache(filename, title)
-#     if blake3_value is not None:
-#         return blake3_value
-
-#     print(f"Calculating blake3 for {filename}: ", end='')
-#     blake3_value = calculate_blake3(filename)
-#     print(f"{blake3_value}")
-
-#     if title not in hashes:
-#         hashes[title] = {}
-
-#     hashes[title]["mtime"] = os.path.getmtime(filename)
-#     hashes[title]["blake3"] = blake3_value
-
-#     sd_hashes.dump_cache()
-
-#     return blake3_value
+import collections
+import hashlib
+import mmap
+import os
+import queue
+import threading
+import time
+
+import civitai.tracing as tracing
+
+#region shared variables
+# Multiples of the page size, large enough that per-call overhead disappears next to the hashing itself
+buffer_size = 8 * 1024 * 1024
+threaded_buffers = 3
+history_size = 200
+
+strategies = ['buffered', 'mmap', 'threaded']
+default_strategy = 'buffered'
+history = collections.deque(maxlen=history_size)
+history_lock = threading.Lock()
+#endregion
+
+#region Algorithms
+def get_hasher(algorithm: str):
+    """A new hasher for `algorithm`, anything hashlib knows plus blake3 when the blake3 package is installed."""
+    if algorithm == 'blake3':
+        from blake3 import blake3
+        return blake3(max_threads=blake3.AUTO)
+    return hashlib.new(algorithm)
+#endregion
+
+#region Strategies
+def advise_sequential(fd: int):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+def hash_buffered(f, hasher, size: int, chunk_size: int):
+    """Read into one reusable buffer, so nothing is allocated per chunk."""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        count = f.readinto(buffer)
+        if not count: break
+        hasher.update(view[:count])
+
+def hash_mmap(f, hasher, size: int, chunk_size: int):
+    """Hash straight out of the page cache, without copying into a user space buffer."""
+    if size == 0: return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, len(mapped), chunk_size):
+                hasher.update(view[offset:offset + chunk_size])
+        finally:
+            view.release()
+
+def hash_threaded(f, hasher, size: int, chunk_size: int):
+    """Read the next chunks on another thread while this one hashes, for storage with high latency like NFS.
+
+    hashlib releases the GIL while hashing large buffers, so reading and hashing overlap.
+    """
+    free = queue.Queue()
+    for _ in range(threaded_buffers): free.put(bytearray(chunk_size))
+    filled = queue.Queue()
+
+    def read():
+        try:
+            while True:
+                buffer = free.get()
+                if buffer is None: return
+                count = f.readinto(buffer)
+                filled.put((buffer, count))
+                if not count: return
+        except Exception as e:
+            filled.put((e, 0))
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            buffer, count = filled.get()
+            if isinstance(buffer, Exception): raise buffer
+            if not count: break
+            hasher.update(memoryview(buffer)[:count])
+            free.put(buffer)
+    finally:
+        free.put(None)
+        reader.join()
+
+strategy_functions = {
+    'buffered': hash_buffered,
+    'mmap': hash_mmap,
+    'threaded': hash_threaded,
+}
+#endregion
+
+def hash_file(path: str, algorithm: str = 'sha256', strategy: str = None, chunk_size: int = None) -> str:
+    """Hash the file at `path` and record how fast it went in `history`."""
+    strategy = strategy or default_strategy
+    hash_into = strategy_functions.get(strategy, hash_buffered)
+    chunk_size = chunk_size or buffer_size
+    hasher = get_hasher(algorithm)
+
+    started = time.perf_counter()
+    with tracing.span('hash', path=path, strategy=strategy) as span, open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        span.set(bytes=size)
+        advise_sequential(f.fileno())
+        hash_into(f, hasher, size, chunk_size)
+    seconds = max(time.perf_counter() - started, 1e-9)
+
+    with history_lock:
+        history.append({'path': path, 'algorithm': algorithm, 'strategy': strategy, 'bytes': size, 'seconds': seconds, 'speed': size / seconds})
+    return hasher.hexdigest()
+
+def sha256(path: str) -> str:
+    return hash_file(path, 'sha256')
+
+def get_stats():
+    """Throughput of the recently hashed files, overall and per strategy, in bytes per second."""
+    with history_lock:
+        entries = list(history)
+
+    def summarize(entries):
+        total_bytes = sum(e['bytes'] for e in entries)
+        total_seconds = sum(e['seconds'] for e in entries)
+        return {'files': len(entries), 'bytes': total_bytes, 'seconds': total_seconds, 'speed': total_bytes / total_seconds if total_seconds > 0 else None}
+
+    stats = summarize(entries)
+    stats['strategies'] = {s: summarize([e for e in entries if e['strategy'] == s]) for s in dict.fromkeys(e['strategy'] for e in entries)}
+    stats['recent'] = entries[-10:]
+    return stats
@@ -0,0 +1,142 @@
+import concurrent.futures
+import threading
+import time
+from typing import Callable, Dict, List
+
+#region shared variables
+progress_interval = 5
+#endregion
+
+def format_bytes(count: float):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if count < 1024: return f'{count:.1f} {unit}'
+        count /= 1024
+    return f'{count:.1f} TB'
+
+def format_duration(seconds: float):
+    seconds = int(seconds)
+    if seconds < 60: return f'{seconds}s'
+    if seconds < 3600: return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+
+class HashQueue:
+    """Hash files on a worker pool, reporting progress and calling `on_hashed(path, hash, titles)` as each finishes
+    (with a hash of None if the file couldn't be read) and `on_idle()` once the queue drains.
+
+    A file submitted again while it's still queued only adds its titles to the pending job.
+    """
+    def __init__(self, hash_file: Callable[[str], str], on_hashed: Callable[[str, str, List[str]], None], on_idle: Callable[[], None] = None, workers: int = 2, log: Callable[[str], None] = print):
+        self.hash_file = hash_file
+        self.on_hashed = on_hashed
+        self.on_idle = on_idle
+        self.log = log
+        self.workers = max(1, workers)
+        self.executor = None
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.jobs: Dict[str, List[str]] = {}
+        self.done: Dict[str, threading.Event] = {}
+        self.reset_progress()
+
+    def reset_progress(self):
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.started = time.time()
+        self.last_report = self.started
+
+    def set_workers(self, workers: int):
+        # Takes effect for the next batch, running jobs keep their pool
+        with self.lock:
+            self.workers = max(1, workers)
+            if self.executor is not None and len(self.jobs) == 0:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def submit(self, path: str, size: int, titles: List[str]):
+        with self.lock:
+            if path in self.jobs:
+                self.jobs[path] += [t for t in titles if t not in self.jobs[path]]
+                return
+            if len(self.jobs) == 0: self.reset_progress()
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='civitai-hash')
+
+            self.jobs[path] = list(titles)
+            self.done[path] = threading.Event()
+            self.files_total += 1
+            self.bytes_total += size
+            self.idle.clear()
+            self.executor.submit(self.run_job, path, size)
+
+    def is_pending(self, path: str):
+        with self.lock:
+            return path in self.jobs
+
+    def wait(self, paths: List[str] = None, timeout: float = None):
+        """Block until `paths`, or every queued file if not given, have been hashed."""
+        if paths is None: return self.idle.wait(timeout)
+
+        with self.lock:
+            events = [self.done[path] for path in paths if path in self.done]
+        deadline = time.time() + timeout if timeout is not None else None
+        for event in events:
+            if not event.wait(max(deadline - time.time(), 0) if deadline is not None else None): return False
+        return True
+
+    def run_job(self, path: str, size: int):
+        value = None
+        try:
+            value = self.hash_file(path)
+        except Exception as e:
+            self.log(f'Failed to hash {path}: {e}')
+
+        with self.lock:
+            titles = self.jobs.get(path, [])
+
+        try:
+            self.on_hashed(path, value, titles)
+        except Exception as e:
+            self.log(f'Failed to store hash of {path}: {e}')
+
+        with self.lock:
+            self.jobs.pop(path, None)
+            done = self.done.pop(path, None)
+            self.files_done += 1
+            self.bytes_done += size
+            finished = len(self.jobs) == 0
+            report = finished or time.time() - self.last_report > progress_interval
+            if report: self.last_report = time.time()
+
+        if done is not None: done.set()
+        if report: self.log_progress(self.progress(), finished)
+        if not finished: return
+
+        try:
+            if self.on_idle is not None: self.on_idle()
+        except Exception as e:
+            self.log(f'Failed to handle finished hashing: {e}')
+        self.idle.set()
+
+    def progress(self):
+        """Counts for the current batch, with speed in bytes per second and the remaining time in seconds."""
+        elapsed = max(time.time() - self.started, 0.001)
+        speed = self.bytes_done / elapsed
+        remaining = self.bytes_total - self.bytes_done
+        return {
+            'filesTotal': self.files_total,
+            'filesDone': self.files_done,
+            'bytesTotal': self.bytes_total,
+            'bytesDone': self.bytes_done,
+            'speed': speed,
+            'remainingTime': remaining / speed if speed > 0 else None,
+        }
+
+    def log_progress(self, progress, finished: bool):
+        if finished:
+            self.log(f"Hashed {progress['filesDone']} files ({format_bytes(progress['bytesDone'])}) at {format_bytes(progress['speed'])}/s")
+            return
+        eta = format_duration(progress['remainingTime']) if progress['remainingTime'] is not None else '?'
+        self.log(f"Hashing {progress['filesDone']}/{progress['filesTotal']} files, {format_bytes(progress['bytesDone'])} of {format_bytes(progress['bytesTotal'])} at {format_bytes(progress['speed'])}/s, ETA {eta}")
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+
+#region shared variables
+# Directory mtimes this close to the scan time may not yet reflect every change (coarse mtime filesystems, writes
+# landing in the same tick), so those directories are listed again on the next refresh.
+racy_mtime_window = 2
+#endregion
+
+class ResourceIndex:
+    """Persistent index of the files under the resource folders, keyed by path.
+
+    Directory listings are kept along with the directory mtime. A refresh only has to stat each directory
+    and list the ones that changed, so its cost scales with the number of changes rather than library size.
+
+    File entries start with just 'size' and 'mtime'. Callers add what they derive from the file contents
+    (fingerprint, hash), and the entries of new or modified files are reset. Sidecar files like previews are
+    looked up in the directory listings with `list_names`.
+
+    Hashes are also remembered by fingerprint, so `find_hash` can tell which file a touched, copied or moved one
+    likely is. The match is not the file's hash, which still has to be computed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.dirs = {}
+        self.files = {}
+        self.fingerprints = {}
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        with self.lock:
+            if self.loaded: return
+            self.loaded = True
+            if not os.path.isfile(self.path): return
+            try:
+                with open(self.path, 'r', encoding='utf8') as f:
+                    data = json.load(f)
+                self.dirs = data.get('dirs', {})
+                self.files = data.get('files', {})
+            except (OSError, ValueError):
+                self.dirs = {}
+                self.files = {}
+            for file in self.files.values():
+                self.remember_hash(file)
+
+    def save(self):
+        # Scans, refreshes and hash workers all save, one at a time so they don't share the temp file
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty: return
+                data = json.dumps({'dirs': self.dirs, 'files': self.files})
+                self.dirty = False
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+
+    def forget_dir(self, dir: str):
+        cached = self.dirs.pop(dir, None)
+        if cached is None: return
+        for name in cached['files']:
+            self.files.pop(os.path.join(dir, name), None)
+        for name in cached['dirs']:
+            self.forget_dir(os.path.join(dir, name))
+        self.dirty = True
+
+    def list_dir(self, dir: str, mtime: float):
+        cached = self.dirs.get(dir, {'files': [], 'dirs': []})
+        files = []
+        dirs = []
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                # Hidden files and folders are skipped, like glob does
+                if entry.name.startswith('.'): continue
+                try:
+                    # is_dir comes from the listing itself on most platforms, only files need a stat
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+
+                files.append(entry.name)
+                file = self.files.get(entry.path)
+                if file is None or file['size'] != st.st_size or file['mtime'] != st.st_mtime:
+                    self.files[entry.path] = {'size': st.st_size, 'mtime': st.st_mtime}
+
+        for name in set(cached['files']) - set(files):
+            self.files.pop(os.path.join(dir, name), None)
+        for name in set(cached['dirs']) - set(dirs):
+            self.forget_dir(os.path.join(dir, name))
+
+        self.dirs[dir] = {'mtime': mtime, 'scanned': time.time(), 'files': files, 'dirs': dirs}
+        self.dirty = True
+
+    def refresh(self, folder: str):
+        """Bring the index up to date for everything under `folder` and return the paths of the files in it."""
+        self.load()
+        paths = []
+        visited = set()
+        with self.lock:
+            pending = [os.path.abspath(folder)]
+            while len(pending) > 0:
+                dir = pending.pop()
+                try:
+                    st = os.stat(dir)
+                except OSError:
+                    self.forget_dir(dir)
+                    continue
+
+                # Don't loop forever on symlinked directories
+                if (st.st_dev, st.st_ino) in visited: continue
+                visited.add((st.st_dev, st.st_ino))
+
+                cached = self.dirs.get(dir)
+                if cached is None or cached['mtime'] != st.st_mtime or st.st_mtime >= cached.get('scanned', 0) - racy_mtime_window:
+                    self.list_dir(dir, st.st_mtime)
+                    cached = self.dirs[dir]
+
+                paths += [os.path.join(dir, name) for name in cached['files']]
+                pending += [os.path.join(dir, name) for name in reversed(cached['dirs'])]
+        return paths
+
+    def invalidate(self, dir: str):
+        """Make the next refresh list `dir` again, e.g. because a file in it was rewritten in place."""
+        with self.lock:
+            cached = self.dirs.get(dir)
+            if cached is not None: cached['mtime'] = None
+
+    def list_names(self, dir: str):
+        """Names of the files in `dir` as of the last refresh."""
+        with self.lock:
+            cached = self.dirs.get(dir)
+            return list(cached['files']) if cached is not None else []
+
+    def get(self, path: str):
+        with self.lock:
+            return self.files.get(path)
+
+    def verify(self, path: str):
+        """The entry for `path`, reset if the file changed since it was recorded. None if the file is gone.
+
+        Rewriting a file in place (cp over it, any O_TRUNC write) leaves its directory's mtime alone, so refresh
+        doesn't notice. Callers about to trust what they derived from a file's contents check it here first.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            file = self.files.get(path)
+            if file is None or file['size'] != st.st_size or file['mtime'] != st.st_mtime:
+                file = self.files[path] = {'size': st.st_size, 'mtime': st.st_mtime}
+                self.dirty = True
+            return file
+
+    def update(self, path: str, **values):
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is None: return
+            entry.update(values)
+            self.remember_hash(entry)
+            self.dirty = True
+
+    def remember_hash(self, file: dict):
+        if file.get('fingerprint') is None or file.get('hash') is None: return
+        self.fingerprints[file['fingerprint']] = file['hash']
+
+    def find_hash(self, fingerprint: str):
+        """The hash of a file with `fingerprint` seen before, if any."""
+        with self.lock:
+            return self.fingerprints.get(fingerprint)
@@ -1,17 +1,36 @@
+import atexit
+import concurrent.futures
+import email.utils
+import hashlib
 import json
 import os
+import random
+import re
 import shutil
 import tempfile
+import threading
 import time
-from typing import List
+from typing import List, Set, Tuple
 import requests
-import glob
+import requests.adapters
 
+from PIL import Image
 from tqdm import tqdm
 from modules import shared, sd_models, sd_vae, hashes
 from modules.ui_extra_networks import extra_pages
 from modules.paths import models_path
 from civitai.models import Command, ResourceRequest
+import civitai.download as download
+import civitai.scheduler as scheduler
+import civitai.ratelimit as ratelimit
+import civitai.cache as cache
+import civitai.index as index
+import civitai.hashqueue as hashqueue
+import civitai.fingerprint as fingerprint
+import civitai.hashes as hashing
+import civitai.lookup as lookup
+import civitai.tracing as tracing
+from civitai.resources import Resource, ResourceSnapshot
 
 #region shared variables
 try:
@@ -19,12 +38,21 @@ try:
 except:
     base_url = 'https://civitai.com/api/v1'
 
+extension_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 connected = False
 user_agent = 'CivitaiLink:Automatic1111'
-download_chunk_size = 8192
 cache_key = 'civitai'
-refresh_previews_function = None
-refresh_info_function = None
+refresh_metadata_function = None
+hashes_ready_function = None
+hash_cache_lock = threading.Lock()
+hash_cache_dirty = False
+hash_cache_flushed = 0
+hash_cache_flush_interval = 30
+download_scheduler = scheduler.Scheduler(int(shared.opts.data.get('civitai_download_concurrency', 2)))
+# Separate budgets so preview and API traffic can't be starved by model downloads, or starve them
+model_bandwidth = ratelimit.TokenBucket()
+preview_bandwidth = ratelimit.TokenBucket()
+tracing.set_enabled(shared.opts.data.get('civitai_tracing', False))
 #endregion
 
 #region Utils
@@ -32,51 +60,190 @@ def log(message):
     """Log a message to the console."""
     print(f'Civitai: {message}')
 
-def download_file(url, dest, on_progress=None):
+def update_bandwidth_limits():
+    """Apply the bandwidth settings (in MB/s, 0 for unlimited) to all transfers, including running ones."""
+    model_bandwidth.set_rate(float(shared.opts.data.get('civitai_bandwidth_models', 0) or 0) * 1024 * 1024)
+    preview_bandwidth.set_rate(float(shared.opts.data.get('civitai_bandwidth_previews', 0) or 0) * 1024 * 1024)
+
+update_bandwidth_limits()
+
+# Destinations being downloaded to. A second download to one waits for the first instead of writing into the same
+# partial file alongside it.
+downloads_in_flight = {}
+downloads_in_flight_lock = threading.Lock()
+
+def download_file(url, dest, on_progress=None, hash=None, bandwidth=None, connections=None, resume=None):
+    key = os.path.abspath(os.path.expanduser(dest))
+    with downloads_in_flight_lock:
+        in_flight = downloads_in_flight.get(key)
+        if in_flight is None: downloads_in_flight[key] = claimed = {'done': threading.Event(), 'error': None}
+
+    if in_flight is not None:
+        log(f'Already downloading to {dest}, waiting for that download')
+        in_flight['done'].wait()
+        if in_flight['error'] is not None: raise download.DownloadError(f'The download to {dest} failed: {in_flight["error"]}')
+        return
+
+    try:
+        fetch_file(url, dest, on_progress, hash, bandwidth, connections, resume)
+    except BaseException as e:
+        claimed['error'] = e
+        raise
+    finally:
+        with downloads_in_flight_lock:
+            downloads_in_flight.pop(key, None)
+        claimed['done'].set()
+
+def fetch_file(url, dest, on_progress=None, hash=None, bandwidth=None, connections=None, resume=None):
     if os.path.exists(dest):
         log(f'File already exists: {dest}')
 
     log(f'Downloading: "{url}" to {dest}\n')
 
-    response = requests.get(url, stream=True, headers={"User-Agent": user_agent})
-    total = int(response.headers.get('content-length', 0))
     start_time = time.time()
+    if connections is None: connections = int(shared.opts.data.get('civitai_download_connections', 4))
+    if resume is None: resume = shared.opts.data.get('civitai_download_resume', True)
+    if bandwidth is None: bandwidth = model_bandwidth
 
     dest = os.path.expanduser(dest)
     dst_dir = os.path.dirname(dest)
-    f = tempfile.NamedTemporaryFile(delete=False, dir=dst_dir)
-
-    try:
-        current = 0
-        with tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024) as bar:
-            for data in response.iter_content(chunk_size=download_chunk_size):
-                current += len(data)
-                pos = f.write(data)
-                bar.update(pos)
-                if on_progress is not None:
-                    should_stop = on_progress(current, total, start_time)
-                    if should_stop == True:
-                        raise Exception('Download cancelled')
-        f.close()
-        shutil.move(f.name, dest)
-    except OSError as e:
-       print(f"Could not write the preview file to {dst_dir}")
-       print(e)
-    finally:
+    if resume:
+        # Partial downloads live next to the destination so a later attempt can pick them up
+        partial_path = dest + '.part'
+    else:
+        # The suffix tells the folder watcher to leave it alone
+        f = tempfile.NamedTemporaryFile(delete=False, dir=dst_dir, suffix='.tmp')
         f.close()
-        if os.path.exists(f.name):
-            os.remove(f.name)
+        partial_path = f.name
+    keep_partial = resume
+
+    # Hash while downloading when we can verify the file or save webui from hashing it again later
+    expected_hash = hash.lower() if hash is not None and len(hash) == 64 else None
+    cache_titles = get_hash_cache_titles(dest)
+    sha256 = hashlib.sha256() if expected_hash is not None or len(cache_titles) > 0 else None
+
+    with tracing.span('download_file', url=url, dest=dest) as span:
+        try:
+            with tqdm(unit='B', unit_scale=True, unit_divisor=1024) as bar:
+                def on_data(current, total):
+                    bar.total = total
+                    bar.update(current - bar.n)
+                    if on_progress is not None:
+                        return on_progress(current, total, start_time)
+
+                download.download(url, partial_path, connections, {"User-Agent": user_agent}, on_data, resume, hash, sha256, bandwidth)
+                span.set(bytes=bar.n)
+
+            if expected_hash is not None and sha256.hexdigest() != expected_hash:
+                # The partial data is bad, resuming from it would only produce the same file
+                keep_partial = False
+                raise download.DownloadError(f'Hash mismatch for {dest}: expected {expected_hash}, got {sha256.hexdigest()}')
+
+            shutil.move(partial_path, dest)
+            if sha256 is not None: seed_hash_cache(dest, cache_titles, sha256.hexdigest(), flush=True)
+        except download.DownloadCancelled as e:
+            keep_partial = resume and e.keep_partial
+            if keep_partial: log(f'Kept partial download of {dest}')
+            raise
+        except requests.RequestException:
+            # Subclasses OSError, but a failed request must reach the caller rather than pass as a download
+            raise
+        except OSError as e:
+           span.set(error=type(e).__name__)
+           print(f"Could not write the preview file to {dst_dir}")
+           print(e)
+        finally:
+            if not keep_partial:
+                download.remove_partial(partial_path)
+
+def seed_hash_cache(filename: str, titles: List[str], sha256: str, flush=False):
+    """Store a hash we already know in the webui hash cache so the file never has to be read back for it.
+
+    The cache file holds every hash the webui knows, so it's written at most every `hash_cache_flush_interval`
+    seconds rather than once per file. Scans and hashing runs call flush_hash_cache when they finish.
+    """
+    global hash_cache_dirty
+    if len(titles) == 0: return
+    with hash_cache_lock:
+        cache = hashes.cache('hashes')
+        mtime = os.path.getmtime(filename)
+        for title in titles:
+            cache[title] = {'mtime': mtime, 'sha256': sha256}
+        hash_cache_dirty = True
+    if flush or time.time() - hash_cache_flushed > hash_cache_flush_interval: flush_hash_cache()
+
+def flush_hash_cache():
+    global hash_cache_dirty, hash_cache_flushed
+    with hash_cache_lock:
+        if not hash_cache_dirty: return
+        hash_cache_dirty = False
+        hash_cache_flushed = time.time()
+        dump_hash_cache()
+
+def dump_hash_cache():
+    # Older webui versions rewrite cache.json in place, which leaves a torn file if we're killed halfway
+    data = getattr(hashes, 'cache_data', None)
+    filename = getattr(hashes, 'cache_filename', None)
+    if data is None or filename is None:
+        hashes.dump_cache()
+        return
+
+    # Those versions guard the file with a filelock, take the same one
+    import filelock
+    with filelock.FileLock(f"{filename}.lock"):
+        tmp_path = filename + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, filename)
+
+atexit.register(flush_hash_cache)
 #endregion Utils
 
 #region API
-def req(endpoint, method='GET', data=None, params=None, headers=None):
-    """Make a request to the Civitai API."""
+api_timeout = 30
+api_retries = 4
+api_backoff = 0.5
+api_max_backoff = 30
+api_retry_statuses = [429, 500, 502, 503, 504]
+api_cache_ttl = 7 * 24 * 60 * 60
+api_cache_negative_ttl = 24 * 60 * 60
+resolve_batch_size = 100
+resolve_min_batch_size = 10
+resolve_concurrency = 4
+resolve_retries = 2
+resolve_slow_batch_time = 5
+api_cache = cache.ResponseCache(os.path.join(extension_dir, 'cache', 'api.json'))
+resource_index = index.ResourceIndex(os.path.join(extension_dir, 'cache', 'resources.json'))
+
+# One pooled session for every API call so connections (and their TLS handshakes) are reused
+api_session = requests.Session()
+api_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+api_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+def get_retry_delay(response, attempt: int):
+    """Seconds to wait before retrying, from Retry-After when the server sent it, otherwise exponential backoff with full jitter.
+    Only the backoff is capped at `api_max_backoff`, the server knows best when it will take requests again."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                return max(0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(api_max_backoff, api_backoff * 2 ** attempt))
+
+def request(endpoint, method='GET', data=None, params=None, headers=None, timeout=None):
+    """Make a request to the Civitai API, retrying rate limits and server errors, and return the response."""
     if headers is None:
         headers = {}
     headers['User-Agent'] = user_agent
     api_key = shared.opts.data.get("civitai_api_key", None)
-    if api_key is not None:
+    if api_key:
         headers['Authorization'] = f'Bearer {api_key}'
+    items = len(data) if isinstance(data, list) else 1
     if data is not None:
         headers['Content-Type'] = 'application/json'
         data = json.dumps(data)
@@ -84,7 +251,34 @@ def req(endpoint, method='GET', data=None, params=None, headers=None):
         endpoint = '/' + endpoint
     if params is None:
         params = {}
-    response = requests.request(method, base_url+endpoint, data=data, params=params, headers=headers)
+    if timeout is None:
+        timeout = api_timeout
+
+    with tracing.span('req', endpoint=endpoint, method=method) as span:
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = api_session.request(method, base_url+endpoint, data=data, params=params, headers=headers, timeout=timeout)
+                preview_bandwidth.consume(len(response.content))
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= api_retries: raise
+
+            if response is not None and response.status_code not in api_retry_statuses: break
+            if response is not None and attempt >= api_retries: break
+
+            delay = get_retry_delay(response, attempt)
+            reason = response.status_code if response is not None else 'connection error'
+            log(f'Request to {endpoint} failed ({reason}), retrying in {delay:.1f}s')
+            time.sleep(delay)
+            attempt += 1
+
+        span.set(status=response.status_code, bytes=len(response.content), retries=attempt, items=items)
+    return response
+
+def req(endpoint, method='GET', data=None, params=None, headers=None, timeout=None):
+    """Make a request to the Civitai API."""
+    response = request(endpoint, method, data, params, headers, timeout)
     if response.status_code != 200:
         raise Exception(f'Error: {response.status_code} {response.text}')
     return response.json()
@@ -103,9 +297,90 @@ def get_models(query, creator, tag, type, page=1, page_size=20, sort='Most Downl
     })
     return response
 
-def get_all_by_hash(hashes: List[str]):
-    response = req(f"/model-versions/by-hash", method='POST', data=hashes)
-    return response
+def get_cached_by_hash(hash: str):
+    """(True, model version or None) if the by-hash cache can answer for `hash`, otherwise (False, None)."""
+    entry = api_cache.get(f'model-versions/by-hash[]:{hash.lower()}')
+    if not api_cache.is_fresh(entry): return False, None
+    return True, entry['value']
+
+def get_all_by_hash(hashes: List[str], flush=True):
+    """Get the model versions for a list of SHA256 hashes, answering from the API cache where possible."""
+    results = {}
+    missing = []
+    for hash in hashes:
+        if hash is None: continue
+        cached, value = get_cached_by_hash(hash)
+        if not cached: missing.append(hash)
+        elif value is not None: results[value['id']] = value
+
+    if len(missing) == 0: return list(results.values())
+
+    response = req(f"/model-versions/by-hash", method='POST', data=missing)
+    found = set()
+    for r in response:
+        if r is None: continue
+        results[r['id']] = r
+        for file in r.get('files', []):
+            file_hash = file.get('hashes', {}).get('SHA256')
+            if file_hash is None: continue
+            found.add(file_hash.lower())
+            api_cache.put(f'model-versions/by-hash[]:{file_hash.lower()}', r, api_cache_ttl)
+
+    # Most unknown hashes are private resources, remember them so we don't keep asking
+    for hash in missing:
+        if hash.lower() not in found:
+            api_cache.put(f'model-versions/by-hash[]:{hash.lower()}', None, api_cache_negative_ttl)
+    if flush: api_cache.flush()
+
+    return list(results.values())
+
+def resolve_hashes(hashes: List[str]):
+    """Look up model versions for any number of hashes.
+
+    Uncached hashes are sent in parallel batches, at most resolve_concurrency at a time. Batches shrink when the
+    API is slow or failing and grow back when it's fast. Failed batches are retried on their own, and hashes that
+    still fail are left out so the caller gets everything that could be resolved.
+    """
+    results = {}
+    pending = []
+    for hash in dict.fromkeys(h for h in hashes if h is not None):
+        cached, value = get_cached_by_hash(hash)
+        if not cached: pending.append(hash)
+        elif value is not None: results[value['id']] = value
+
+    batch_size = resolve_batch_size
+    attempts = {}
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=resolve_concurrency) as executor:
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < resolve_concurrency:
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                running[executor.submit(get_all_by_hash, batch, False)] = (batch, time.time())
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                batch, started = running.pop(future)
+                try:
+                    for r in future.result():
+                        results[r['id']] = r
+                except Exception as e:
+                    log(f'Failed to resolve a batch of {len(batch)} hashes: {e}')
+                    batch_size = max(resolve_min_batch_size, batch_size // 2)
+                    for hash in batch:
+                        attempts[hash] = attempts.get(hash, 0) + 1
+                        if attempts[hash] > resolve_retries: failed.append(hash)
+                        else: pending.append(hash)
+                    continue
+
+                if time.time() - started > resolve_slow_batch_time:
+                    batch_size = max(resolve_min_batch_size, batch_size // 2)
+                else:
+                    batch_size = min(resolve_batch_size, batch_size + resolve_min_batch_size)
+
+    api_cache.flush()
+    if len(failed) > 0: log(f'Could not resolve {len(failed)} hashes')
+    return list(results.values())
 
 def get_model_version(id):
     """Get a model version from the Civitai API."""
@@ -113,8 +388,30 @@ def get_model_version(id):
     return response
 
 def get_model_version_by_hash(hash: str):
-    response = req(f"/model-versions/by-hash/{hash}")
-    return response
+    """Get a model version by hash, or None if Civitai doesn't know it. Cached and revalidated with ETags."""
+    key = f'model-versions/by-hash:{hash.lower()}'
+    entry = api_cache.get(key)
+    if api_cache.is_fresh(entry): return entry['value']
+
+    headers = {}
+    if entry is not None and entry['etag'] is not None:
+        headers['If-None-Match'] = entry['etag']
+    response = request(f"/model-versions/by-hash/{hash}", headers=headers)
+
+    if response.status_code == 304:
+        api_cache.refresh(key, api_cache_ttl)
+        value = entry['value']
+    elif response.status_code == 404:
+        api_cache.put(key, None, api_cache_negative_ttl)
+        value = None
+    elif response.status_code == 200:
+        value = response.json()
+        api_cache.put(key, value, api_cache_ttl, response.headers.get('ETag'))
+    else:
+        raise Exception(f'Error: {response.status_code} {response.text}')
+
+    api_cache.flush()
+    return value
 
 def get_creators(query, page=1, page_size=20):
     """Get a list of creators from the Civitai API."""
@@ -145,7 +442,7 @@ def get_locon_dir():
     try:
         lyco_dir = shared.opts.data.get('civitai_folder_lyco', shared.cmd_opts.lyco_dir).strip()
         if not lyco_dir: lyco_dir = shared.cmd_opts.lyco_dir
-        if not lyco_dir: lyco_dir = os.path.join(models_path, "LyCORIS"),
+        if not lyco_dir: lyco_dir = os.path.join(models_path, "LyCORIS")
         return lyco_dir
     except:
         return get_lora_dir()
@@ -173,101 +470,339 @@ def get_automatic_name(type: str, filename: str, folder: str):
     if type == 'Checkpoint': return fullname
     return os.path.splitext(fullname)[0]
 
-def has_preview(filename: str):
-    preview_exts = [".jpg", ".png", ".jpeg", ".gif"]
-    preview_exts = [*preview_exts, *[".preview" + x for x in preview_exts]]
+def get_resource_folders():
+    """The folders scanned for each resource type as (type, folder, exts, exts_exclude)."""
+    return [
+        ('LORA', get_lora_dir(), ['pt', 'safetensors', 'ckpt'], []),
+        ('LoCon', get_locon_dir(), ['pt', 'safetensors', 'ckpt'], []),
+        ('Hypernetwork', shared.cmd_opts.hypernetwork_dir, ['pt', 'safetensors', 'ckpt'], []),
+        ('TextualInversion', shared.cmd_opts.embeddings_dir, ['pt', 'bin', 'safetensors'], []),
+        ('Checkpoint', get_model_dir(), ['safetensors', 'ckpt'], ['vae.safetensors', 'vae.ckpt']),
+        ('Controlnet', os.path.join(models_path, "ControlNet"), ['safetensors', 'ckpt'], ['vae.safetensors', 'vae.ckpt']),
+        ('Upscaler', os.path.join(models_path, "ESRGAN"), ['safetensors', 'ckpt', 'pt'], []),
+        ('VAE', get_model_dir(), ['vae.pt', 'vae.safetensors', 'vae.ckpt'], []),
+        ('VAE', sd_vae.vae_path, ['pt', 'safetensors', 'ckpt'], []),
+    ]
+
+def get_hash_cache_titles(filename: str):
+    """The hash cache titles get_resources_in_folder will look up for `filename`."""
+    filename = os.path.abspath(os.path.expanduser(filename))
+    titles = []
+    for type, folder, exts, exts_exclude in get_resource_folders():
+        folder = os.path.abspath(folder)
+        if not filename.startswith(folder + os.sep): continue
+        if not any(filename.endswith('.' + ext) for ext in exts): continue
+        if any(filename.endswith(ext) for ext in exts_exclude): continue
+        titles.append(f"{get_automatic_type(type)}/{get_automatic_name(type, filename, folder)}")
+    return titles
+
+def get_resource_types_for_paths(paths: List[str]):
+    """The resource types whose folders contain any of `paths`."""
+    types = []
+    for type, folder, _, _ in get_resource_folders():
+        folder = os.path.abspath(folder)
+        if type in types: continue
+        if any(path == folder or path.startswith(folder + os.sep) for path in paths): types.append(type)
+    return types
+
+preview_exts = [".jpg", ".png", ".jpeg", ".gif", ".webp"]
+preview_exts = [*preview_exts, *[".preview" + x for x in preview_exts]]
+
+def get_dir_names(dir: str) -> Set[str]:
+    """The names in `dir`, normcased for matching sidecar files against."""
+    try:
+        return {os.path.normcase(name) for name in os.listdir(dir)}
+    except OSError:
+        return set()
+
+def find_preview(filename: str, names: Set[str] = None):
+    """The path of the preview image for `filename`, or None. `names` is its directory listing from get_dir_names."""
+    if names is None: names = get_dir_names(os.path.dirname(filename))
+    base = os.path.splitext(filename)[0]
+    stem = os.path.normcase(os.path.basename(base))
     for ext in preview_exts:
-        if os.path.exists(os.path.splitext(filename)[0] + ext):
-            return True
-    return False
+        if stem + ext in names: return base + ext
+    return None
 
-def has_info(filename: str):
-    return os.path.isfile(os.path.splitext(filename)[0] + '.json')
+def has_preview(filename: str, names: Set[str] = None):
+    return find_preview(filename, names) is not None
+
+def has_info(filename: str, names: Set[str] = None):
+    if names is None: names = get_dir_names(os.path.dirname(filename))
+    return os.path.normcase(os.path.splitext(os.path.basename(filename))[0] + '.json') in names
 
 def get_resources_in_folder(type, folder, exts=[], exts_exclude=[]):
-    resources = []
-    os.makedirs(folder, exist_ok=True)
+    return scan_folder(folder, [(type, exts, exts_exclude)])
+
+def scan_folder(folder, resource_types):
+    """List the resources under `folder` for every (type, exts, exts_exclude) in `resource_types` in a single walk."""
+    with tracing.span('scan_folder', folder=folder) as span:
+        resources = list_folder_resources(folder, resource_types)
+        span.set(items=len(resources))
+    return resources
 
-    candidates = []
-    for ext in exts:
-        candidates += glob.glob(os.path.join(folder, '**/*.' + ext), recursive=True)
-    for ext in exts_exclude:
-        candidates = [x for x in candidates if not x.endswith(ext)]
+def list_folder_resources(folder, resource_types):
+    resources: List[Resource] = []
+    os.makedirs(folder, exist_ok=True)
 
     folder = os.path.abspath(folder)
-    automatic_type = get_automatic_type(type)
-    for filename in sorted(candidates):
-        if os.path.isdir(filename):
+    matchers = [(type, get_automatic_type(type), tuple('.' + ext for ext in exts), tuple(exts_exclude)) for type, exts, exts_exclude in resource_types]
+    # Sidecar files are found in the listings the index already has, instead of probing for each candidate name
+    dir_names = {}
+    for filename in sorted(resource_index.refresh(folder)):
+        suffix_name = os.path.normcase(filename)
+        for type, automatic_type, exts, exts_exclude in matchers:
+            if not suffix_name.endswith(exts) or (len(exts_exclude) > 0 and suffix_name.endswith(exts_exclude)): continue
+
+            # Only files that are new or changed since the last scan need hashing
+            entry = resource_index.verify(filename)
+            if entry is None: continue
+            if 'fingerprint' not in entry:
+                resource_index.update(filename, fingerprint=get_fingerprint(filename, entry['size']))
+            if 'hash' not in entry:
+                title = f"{automatic_type}/{get_automatic_name(type, filename, folder)}"
+                sha256 = hashes.sha256_from_cache(filename, title)
+                if sha256 is not None or shared.cmd_opts.no_hashing:
+                    resource_index.update(filename, hash=sha256)
+                else:
+                    pending = unhashed.setdefault(filename, {'size': entry['size'], 'titles': []})
+                    pending['size'] = entry['size']
+                    if title not in pending['titles']: pending['titles'].append(title)
+                    # A touched, copied or moved file we've hashed before. The fingerprint only tells us which file
+                    # it likely is, its exact hash is still computed before anything relies on it
+                    if entry['fingerprint'] is not None: pending['likely'] = resource_index.find_hash(entry['fingerprint'])
+
+            dir = os.path.dirname(filename)
+            names = dir_names.get(dir)
+            if names is None:
+                names = dir_names[dir] = {os.path.normcase(name) for name in resource_index.list_names(dir)}
+            preview = find_preview(filename, names)
+
+            name = os.path.splitext(os.path.basename(filename))[0]
+            resources.append(Resource(type, name, entry.get('hash'), entry['fingerprint'], filename, preview is not None, preview, has_info(filename, names), True if 'hash' not in entry else None))
+
+    return resources
+
+def get_fingerprint(filename: str, size: int):
+    try:
+        return fingerprint.fingerprint(filename, size)
+    except OSError:
+        return None
+
+# New files are only fingerprinted by the scan and listed with 'hashPending'. Their SHA256 is computed in the
+# background once something needs the exact hash, see ensure_hashes.
+unhashed = {}
+# Finished hashes go into the snapshot in batches, at most every `hashed_apply_interval` seconds and whenever
+# someone waits on them, since every new snapshot copies the resource list
+hashed_files = {}
+hashed_lock = threading.Lock()
+hashed_applied = 0
+hashed_apply_interval = 1
+
+def on_file_hashed(filename: str, sha256: str, titles: List[str]):
+    unhashed.pop(filename, None)
+    # Files that failed to hash are listed without one, and tried again once they change
+    if sha256 is not None: seed_hash_cache(filename, titles, sha256)
+
+    # Holding the index lock waits out a scan in progress, so its resources are in the snapshot before ours
+    with resource_index.lock:
+        if sha256 is not None: resource_index.update(filename, hash=sha256)
+    with hashed_lock:
+        hashed_files[filename] = sha256
+        due = time.time() - hashed_applied > hashed_apply_interval
+    if due: apply_hashed_files()
+
+def apply_hashed_files():
+    """Swap the records of the files hashed since the last call for ones with their hash, in one new snapshot."""
+    global hashed_applied
+    def update(snapshot: ResourceSnapshot):
+        replaced = [(resource, resource.replace(hash=sha256, hashPending=None)) for path, sha256 in hashed_files.items() for resource in snapshot.lookup.find_pending_path(path)]
+        return snapshot.replace(replaced) if len(replaced) > 0 else snapshot
+
+    # Held throughout, so a caller finding nothing left to apply knows the snapshot has it all
+    with hashed_lock:
+        hashed_applied = time.time()
+        if len(hashed_files) == 0: return
+        update_snapshot(update)
+        hashed_files.clear()
+
+def on_hashing_idle():
+    apply_hashed_files()
+    flush_hash_cache()
+    resource_index.save()
+    if hashes_ready_function is not None: hashes_ready_function()
+
+def ensure_hashes(resources: List[Resource], wait=True, compute=True) -> List[Resource]:
+    """Compute the SHA256 of any of `resources` still waiting on one, blocking until they're done if `wait`.
+    Returns the current records for `resources`, with the hashes that are in.
+
+    With `compute` False only hashes the webui has cached since the scan are picked up.
+    """
+    paths = []
+    for resource in resources:
+        if not resource.get('hashPending'): continue
+        pending = unhashed.get(resource['path'])
+        if pending is None: continue
+
+        # The webui may have hashed it in the meantime, e.g. when loading the checkpoint
+        cached = [hashes.sha256_from_cache(resource['path'], title) for title in pending['titles']]
+        cached = [sha256 for sha256 in cached if sha256 is not None]
+        if len(cached) > 0:
+            on_file_hashed(resource['path'], cached[0], pending['titles'])
             continue
+        if not compute: continue
 
-        name = os.path.splitext(os.path.basename(filename))[0]
-        automatic_name = get_automatic_name(type, filename, folder)
-        hash = hashes.sha256(filename, f"{automatic_type}/{automatic_name}")
+        paths.append(resource['path'])
+        hash_queue.submit(resource['path'], pending['size'], pending['titles'])
 
-        resources.append({'type': type, 'name': name, 'hash': hash, 'path': filename, 'hasPreview': has_preview(filename), 'hasInfo': has_info(filename) })
+    if wait and len(paths) > 0: hash_queue.wait(paths)
+    apply_hashed_files()
+    return [get_current_record(resource) for resource in resources]
 
-    return resources
+def get_current_record(resource: Resource):
+    """The record for the same file in the current snapshot, since records are replaced when their hash comes in."""
+    if not resource.get('hashPending'): return resource
+    for current in resource_snapshot.lookup.find_name(resource.type, resource.name):
+        if current.path == resource.path: return current
+    return resource
+
+def hash_resource_file(filename: str):
+    return hashing.hash_file(filename, 'sha256', shared.opts.data.get('civitai_hash_strategy', hashing.default_strategy))
+
+hash_queue = hashqueue.HashQueue(hash_resource_file, on_file_hashed, on_hashing_idle, int(shared.opts.data.get('civitai_hash_workers', 2)), log)
+
+resource_types = ['LORA', 'LoCon', 'Hypernetwork', 'TextualInversion', 'Checkpoint', 'VAE', 'Controlnet', 'Upscaler']
+# The resource list is published as immutable snapshots. Readers use whatever is current without locking,
+# writers build the next snapshot and swap it in under snapshot_lock.
+resource_snapshot = ResourceSnapshot()
+resources_loaded = False
+snapshot_lock = threading.Lock()
+checkpoint_lookup = lookup.CheckpointLookup(lambda: sd_models.checkpoints_list)
 
-resources = []
-def load_resource_list(types=['LORA', 'LoCon', 'Hypernetwork', 'TextualInversion', 'Checkpoint', 'VAE', 'Controlnet', 'Upscaler']):
-    global resources
+def update_snapshot(update) -> ResourceSnapshot:
+    global resource_snapshot
+    with snapshot_lock:
+        resource_snapshot = update(resource_snapshot)
+        return resource_snapshot
+
+def load_resource_list(types=resource_types) -> List[Resource]:
+    """Rescan the resources of `types` and return the full list. Waits for the scan, see get_resources for readers that shouldn't."""
+    global resources_loaded
 
     # If resources is empty and types is empty, load all types
     # This is a helper to be able to get the resource list without
     # having to worry about initialization. On subsequent calls, no work will be done
-    if len(resources) == 0 and len(types) == 0:
-        types = ['LORA', 'LoCon', 'Hypernetwork', 'TextualInversion', 'Checkpoint', 'VAE', 'Controlnet', 'Upscaler']
-
-    if 'LORA' in types:
-        resources = [r for r in resources if r['type'] != 'LORA']
-        resources += get_resources_in_folder('LORA', get_lora_dir(), ['pt', 'safetensors', 'ckpt'])
-    if 'LoCon' in types:
-        resources = [r for r in resources if r['type'] != 'LoCon']
-        resources += get_resources_in_folder('LoCon', get_locon_dir(), ['pt', 'safetensors', 'ckpt'])
-    if 'Hypernetwork' in types:
-        resources = [r for r in resources if r['type'] != 'Hypernetwork']
-        resources += get_resources_in_folder('Hypernetwork', shared.cmd_opts.hypernetwork_dir, ['pt', 'safetensors', 'ckpt'])
-    if 'TextualInversion' in types:
-        resources = [r for r in resources if r['type'] != 'TextualInversion']
-        resources += get_resources_in_folder('TextualInversion', shared.cmd_opts.embeddings_dir, ['pt', 'bin', 'safetensors'])
-    if 'Checkpoint' in types:
-        resources = [r for r in resources if r['type'] != 'Checkpoint']
-        resources += get_resources_in_folder('Checkpoint', get_model_dir(), ['safetensors', 'ckpt'], ['vae.safetensors', 'vae.ckpt'])
-    if 'Controlnet' in types:
-        resources = [r for r in resources if r['type'] != 'Controlnet']
-        resources += get_resources_in_folder('Controlnet', os.path.join(models_path, "ControlNet"), ['safetensors', 'ckpt'], ['vae.safetensors', 'vae.ckpt'])
-    if 'Upscaler' in types:
-        resources = [r for r in resources if r['type'] != 'Upscaler']
-        resources += get_resources_in_folder('Upscaler', os.path.join(models_path, "ESRGAN"), ['safetensors', 'ckpt', 'pt'])
-    if 'VAE' in types:
-        resources = [r for r in resources if r['type'] != 'VAE']
-        resources += get_resources_in_folder('VAE', get_model_dir(), ['vae.pt', 'vae.safetensors', 'vae.ckpt'])
-        resources += get_resources_in_folder('VAE', sd_vae.vae_path, ['pt', 'safetensors', 'ckpt'])
-
-    return resources
-
-def get_resource_by_hash(hash: str):
-    resources = load_resource_list([])
+    if not resources_loaded and len(types) == 0:
+        types = resource_types
+
+    # Types sharing a folder (Checkpoint and VAE in the models folder) are served by one walk of it
+    roots = {}
+    for type, folder, exts, exts_exclude in get_resource_folders():
+        if type in types:
+            roots.setdefault(os.path.abspath(folder), []).append((type, exts, exts_exclude))
+
+    # Calls that scan nothing (types=[] once loaded) would only flood the trace
+    scan_span = tracing.span('scan', types=types) if len(roots) > 0 else tracing.null_span
+    with scan_span as span, resource_index.lock:
+        scanned = []
+        for folder, folder_types in roots.items():
+            scanned += scan_folder(folder, folder_types)
+        span.set(items=len(scanned))
+
+        def update(snapshot: ResourceSnapshot):
+            removed = snapshot.of_types(types)
+            # Keep the snapshot, and its version, when nothing changed
+            if [r.to_dict() for r in removed] == [r.to_dict() for r in scanned]: return snapshot
+            return snapshot.derive(removed, scanned)
+        snapshot = update_snapshot(update)
+        if len(types) > 0: resources_loaded = True
+    resource_index.save()
+    flush_hash_cache()
+
+    return list(snapshot.records)
+
+def is_scanning():
+    """True while another thread's scan holds the resource index, which storing finished hashes waits for."""
+    if not resource_index.lock.acquire(blocking=False): return True
+    resource_index.lock.release()
+    return False
 
-    found = [resource for resource in resources if hash.lower() == resource['hash'] and ('downloading' not in resource or resource['downloading'] != True)]
+def get_resources() -> ResourceSnapshot:
+    """The last complete resource snapshot. Never waits on a rescan, only the first call scans, since before it there is
+    no snapshot to serve (restarts read it from the resource index, so this is quick)."""
+    if not resources_loaded: load_resource_list([])
+    return resource_snapshot
+
+refresh_lock = threading.Lock()
+refresh_types = set()
+refresh_callbacks = []
+refresh_running = False
+
+def refresh_resources(types: List[str] = resource_types, on_done=None):
+    """Rescan `types` on a background thread and swap in the result, calling `on_done(old_snapshot, new_snapshot)`.
+
+    Requests made while a refresh runs are merged into the next one.
+    """
+    global refresh_running
+    with refresh_lock:
+        refresh_types.update(types)
+        if on_done is not None: refresh_callbacks.append(on_done)
+        if refresh_running: return
+        refresh_running = True
+    threading.Thread(target=run_refreshes, daemon=True).start()
+
+def run_refreshes():
+    global refresh_running
+    while True:
+        with refresh_lock:
+            types = [type for type in resource_types if type in refresh_types]
+            callbacks = list(refresh_callbacks)
+            refresh_types.clear()
+            refresh_callbacks.clear()
+            if len(types) == 0 and len(callbacks) == 0:
+                refresh_running = False
+                return
+
+        old_snapshot = resource_snapshot
+        try:
+            load_resource_list(types)
+        except Exception as e:
+            log(f'Failed to refresh resources: {e}')
+        for callback in callbacks:
+            try:
+                callback(old_snapshot, resource_snapshot)
+            except Exception as e:
+                log(f'Failed to handle refreshed resources: {e}')
+
+def get_resource_by_hash(hash: str, types: List[str] = None, name: str = None):
+    """The local resource with `hash`. Of the files still waiting on their SHA256, only those that plausibly are it get
+    hashed (blocking until they are): ones with the fingerprint of a file hashed as `hash` before, or named `name`."""
+    load_resource_list([])
+    hash = hash.lower()
+
+    found = [resource for resource in resource_snapshot.lookup.find_hash(hash) if resource.get('downloading') != True]
     if found:
         return found[0]
 
-    return None
+    name = os.path.splitext(name)[0] if name is not None else None
+    candidates = [resource for resource in resource_snapshot.lookup.find_pending(types) if resource['name'] == name or unhashed.get(resource['path'], {}).get('likely') == hash]
+    if len(candidates) == 0: return None
+    found = [resource for resource in ensure_hashes(candidates) if resource.get('hash') == hash]
+    return found[0] if found else None
 
-def get_model_by_hash(hash: str):
-    found = [info for info in sd_models.checkpoints_list.values() if hash == info.sha256 or hash == info.shorthash or hash == info.hash]
-    if found:
-        return found[0]
+def remove_downloading(hash: str):
+    """Drop the placeholder of a download that didn't finish."""
+    update_snapshot(lambda snapshot: snapshot.derive([r for r in snapshot.lookup.find_hash(hash) if r.downloading], []))
 
-    return None
+def get_model_by_hash(hash: str):
+    return checkpoint_lookup.find(hash)
 
 #endregion Get Utils
 
 #region Removing
 def remove_resource(resource: ResourceRequest):
     removed = None
-    target = get_resource_by_hash(resource['hash'])
+    target = get_resource_by_hash(resource['hash'], [resource['type']], resource.get('name'))
     if target is None or target['type'] != resource['type']: removed = False
     elif os.path.exists(target['path']):
         os.remove(target['path'])
@@ -287,21 +822,22 @@ def remove_resource(resource: ResourceRequest):
 #endregion Removing
 
 #region Downloading
-def load_if_missing(path, url, on_progress=None):
+def load_if_missing(path, url, on_progress=None, hash=None):
     if os.path.exists(path): return True
     if url is None: return False
 
-    download_file(url, path, on_progress)
+    download_file(url, path, on_progress, hash)
     return None
 
 def load_resource(resource: ResourceRequest, on_progress=None):
     resource['hash'] = resource['hash'].lower()
-    existing_resource = get_resource_by_hash(resource['hash'])
+    existing_resource = get_resource_by_hash(resource['hash'], [resource['type']], resource['name'])
     if existing_resource:
         log(f'Already have resource: {resource["name"]}')
         return
 
-    resources.append({'type': resource['type'], 'name': resource['name'], 'hash': resource['hash'], 'downloading': True })
+    downloading = Resource(resource['type'], resource['name'], resource['hash'], downloading=True)
+    update_snapshot(lambda snapshot: snapshot.derive([], [downloading]))
 
     if resource['type'] == 'Checkpoint': load_model(resource, on_progress)
     elif resource['type'] == 'CheckpointConfig': load_model_config(resource, on_progress)
@@ -327,10 +863,11 @@ def fetch_model_by_hash(hash: str):
         hash=file['hashes']['SHA256'],
         url=file['downloadUrl']
     )
-    load_resource(resource)
+    # Someone is waiting on this model, let it skip ahead of queued Link downloads
+    download_scheduler.submit(f'fetch:{resource["hash"]}', lambda: load_resource(resource), scheduler.PRIORITY_HIGH).wait()
 
 def load_model_config(resource: ResourceRequest, on_progress=None):
-    load_if_missing(os.path.join(get_model_dir(), resource['name']), resource['url'], on_progress)
+    load_if_missing(os.path.join(get_model_dir(), resource['name']), resource['url'], on_progress, resource['hash'])
 
 def load_model(resource: ResourceRequest, on_progress=None):
     model = get_model_by_hash(resource['hash'])
@@ -338,41 +875,39 @@ def load_model(resource: ResourceRequest, on_progress=None):
         log('Found model in model list')
     if model is None and resource['url'] is not None:
         log('Downloading model')
-        download_file(resource['url'], os.path.join(get_model_dir(), resource['name']), on_progress)
+        download_file(resource['url'], os.path.join(get_model_dir(), resource['name']), on_progress, resource['hash'])
         sd_models.list_models()
         model = get_model_by_hash(resource['hash'])
 
     return model
 
 def load_controlnet(resource: ResourceRequest, on_progress=None):
-    isAvailable = load_if_missing(os.path.join(models_path, 'ControlNet', resource['name']), resource['url'], on_progress)
+    isAvailable = load_if_missing(os.path.join(models_path, 'ControlNet', resource['name']), resource['url'], on_progress, resource['hash'])
     # TODO: reload controlnet list - not sure best way to import this
     # if isAvailable is None:
         # controlnet.list_available_models()
 
 def load_upscaler(resource: ResourceRequest, on_progress=None):
-    isAvailable = load_if_missing(os.path.join(models_path, 'ESRGAN', resource['name']), resource['url'], on_progress)
+    isAvailable = load_if_missing(os.path.join(models_path, 'ESRGAN', resource['name']), resource['url'], on_progress, resource['hash'])
     # TODO: reload upscaler list - not sure best way to import this
     # if isAvailable is None:
         # upscaler.list_available_models()
 
 def load_textual_inversion(resource: ResourceRequest, on_progress=None):
-    load_if_missing(os.path.join(shared.cmd_opts.embeddings_dir, resource['name']), resource['url'], on_progress)
+    load_if_missing(os.path.join(shared.cmd_opts.embeddings_dir, resource['name']), resource['url'], on_progress, resource['hash'])
 
 def load_lora(resource: ResourceRequest, on_progress=None):
-    isAvailable = load_if_missing(os.path.join(get_lora_dir(), resource['name']), resource['url'], on_progress)
+    isAvailable = load_if_missing(os.path.join(get_lora_dir(), resource['name']), resource['url'], on_progress, resource['hash'])
     if isAvailable is None:
         page = next(iter([x for x in extra_pages if x.name == "lora"]), None)
         if page is not None:
             log('Refreshing Loras')
             page.refresh()
-            if refresh_previews_function is not None:
-                refresh_previews_function()
-            if refresh_info_function is not None:
-                refresh_info_function()
+            if refresh_metadata_function is not None:
+                refresh_metadata_function()
 
 def load_locon(resource: ResourceRequest, on_progress=None):
-    isAvailable = load_if_missing(os.path.join(get_locon_dir(), resource['name']), resource['url'], on_progress)
+    isAvailable = load_if_missing(os.path.join(get_locon_dir(), resource['name']), resource['url'], on_progress, resource['hash'])
     if isAvailable is None:
         page = next(iter([x for x in extra_pages if x.name == "lora"]), None)
         if page is not None:
@@ -384,14 +919,14 @@ def load_vae(resource: ResourceRequest, on_progress=None):
     if not resource['name'].endswith('.pt'): resource['name'] += '.pt'
     full_path = os.path.join(models_path, 'VAE', resource['name'])
 
-    isAvailable = load_if_missing(full_path, resource['url'], on_progress)
+    isAvailable = load_if_missing(full_path, resource['url'], on_progress, resource['hash'])
     if isAvailable is None:
         sd_vae.refresh_vae_list()
 
 def load_hypernetwork(resource: ResourceRequest, on_progress=None):
     full_path = os.path.join(shared.cmd_opts.hypernetwork_dir, resource['name']);
     if not full_path.endswith('.pt'): full_path += '.pt'
-    isAvailable = load_if_missing(full_path, resource['url'], on_progress)
+    isAvailable = load_if_missing(full_path, resource['url'], on_progress, resource['hash'])
     if isAvailable is None:
         shared.reload_hypernetworks()
 
@@ -458,15 +993,62 @@ def clear_hypernetwork():
 #endregion
 
 #region Resource Management
+preview_concurrency = 4
+preview_file_exts = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp'}
+
+def get_preview_url(url: str, max_size: int):
+    """Ask the Civitai image CDN for a resized variant instead of the original upload."""
+    return re.sub(r'/(width=\d+|original=true)/', f'/width={max_size}/', url, count=1)
+
+def transcode_preview(source: str, dest: str, max_size: int, format: str):
+    with Image.open(source) as image:
+        image.thumbnail((max_size, max_size))
+        if format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(dest, format=format.upper(), quality=85, optimize=True)
+
 def update_resource_preview(hash: str, preview_url: str):
-    resources = load_resource_list([])
-    matches = [resource for resource in resources if hash.lower() == resource['hash']]
-    if len(matches) == 0: return
-
-    for resource in matches:
-        # download image and save to resource['path'] - ext + '.preview.png'
-        preview_path = os.path.splitext(resource['path'])[0] + '.preview.png'
-        download_file(preview_url, preview_path)
+    """Save a preview thumbnail next to every resource with `hash`. Returns True if any were written."""
+    with tracing.span('update_resource_preview', hash=hash) as span:
+        load_resource_list([])
+        matches = [resource for resource in resource_snapshot.lookup.find_hash(hash) if 'path' in resource]
+        span.set(items=len(matches))
+        if len(matches) == 0: return False
+
+        max_size = int(shared.opts.data.get('civitai_preview_size', 512))
+        format = shared.opts.data.get('civitai_preview_format', 'jpeg')
+        if format not in preview_file_exts: format = 'jpeg'
+
+        # download the image once, then save a thumbnail to resource['path'] - ext + '.preview.' + format for each match
+        download_path = os.path.splitext(matches[0]['path'])[0] + '.preview.download'
+        # Previews are small, one plain request without resume state next to the models is all they need
+        download_file(get_preview_url(preview_url, max_size), download_path, bandwidth=preview_bandwidth, connections=1, resume=False)
+        if not os.path.exists(download_path): return False
+
+        try:
+            for resource in matches:
+                preview_base = os.path.splitext(resource['path'])[0] + '.preview'
+                try:
+                    transcode_preview(download_path, f'{preview_base}.{preview_file_exts[format]}', max_size, format)
+                except Exception as e:
+                    # Not an image PIL understands (e.g. a video preview), keep it as it came like we used to
+                    log(f'Could not create a preview thumbnail for {resource["name"]}: {e}')
+                    shutil.copyfile(download_path, f'{preview_base}.png')
+        finally:
+            os.remove(download_path)
+        return True
+
+def update_resource_previews(previews: List[Tuple[str, str]]):
+    """Run update_resource_preview for (hash, preview_url) pairs on a bounded pool. Returns how many succeeded."""
+    updated = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=preview_concurrency) as executor:
+        futures = [executor.submit(update_resource_preview, hash, preview_url) for hash, preview_url in previews]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                if future.result(): updated += 1
+            except Exception as e:
+                log(f'Failed to download preview: {e}')
+    return updated
 
 #endregion Selecting Resources
 
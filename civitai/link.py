@@ -1,10 +1,12 @@
 from datetime import datetime, timezone
+import threading
 import time
 from typing import List
 import socketio
 
 import civitai.lib as civitai
 import civitai.generation as generation
+import civitai.scheduler as scheduler
 from civitai.models import Command, CommandActivitiesList, CommandImageTxt2Img, CommandResourcesAdd, CommandActivitiesCancel, CommandResourcesList, CommandResourcesRemove, ErrorPayload, JoinedPayload, RoomPresence, UpgradeKeyPayload
 
 from modules import shared, sd_models, script_callbacks, hashes
@@ -16,12 +18,24 @@ def log(message: str):
 #endregion
 
 #region Civitai Link Command Handlers
-def send_resources(types: List[str] = []):
-    command_response({'type': 'resources:list', 'resources': civitai.load_resource_list(types)})
+def list_resources():
+    snapshot = civitai.get_resources()
+    # Civitai identifies resources by SHA256, hash the new ones in the background and send the list again when done
+    civitai.ensure_hashes(snapshot.lookup.find_pending(), wait=False)
+    return snapshot.to_dicts()
+
+def send_resources():
+    command_response({'type': 'resources:list', 'resources': list_resources()})
+
+def on_resources_refreshed(old_snapshot, new_snapshot):
+    if new_snapshot is not old_snapshot: send_resources()
 
 def on_resources_list(payload: CommandResourcesList):
+    # Answer from the last snapshot right away, and follow up with the list again if a rescan changes it
     types = payload['types'] if 'types' in payload else []
-    payload['resources'] = civitai.load_resource_list(types)
+    if len(types) > 0 or not civitai.resources_loaded:
+        civitai.refresh_resources(types or civitai.resource_types, on_resources_refreshed)
+    payload['resources'] = list_resources()
     payload['status'] = 'success'
     command_response(payload)
 
@@ -39,6 +53,7 @@ def on_activities_clear(payload: CommandActivitiesList):
 report_interval = 1
 processing_activities: List[str] = []
 should_cancel_activity: List[str] = []
+keep_partial_activity: List[str] = []
 def on_resources_add(payload: CommandResourcesAdd):
     resource = payload['resource']
     payload['status'] = 'processing'
@@ -60,60 +75,85 @@ def on_resources_add(payload: CommandResourcesAdd):
 
         if payload['id'] in should_cancel_activity:
             should_cancel_activity.remove(payload['id'])
-            dl_resources = [r for r in civitai.resources if r['hash'] == resource['hash'] and r['downloading'] == True]
-            if len(dl_resources) > 0:
-                civitai.resources.remove(dl_resources[0])
+            civitai.remove_downloading(resource['hash'])
             payload['status'] = 'canceled'
-            return True
+            if payload['id'] in keep_partial_activity:
+                keep_partial_activity.remove(payload['id'])
+                return civitai.download.CANCEL_KEEP_PARTIAL
+            return civitai.download.CANCEL
 
         current_time = time.time()
         elapsed_time = current_time - start_time
         speed = current / elapsed_time
-        remaining_time = (total - current) / speed
-        progress = current / total * 100
+        remaining_time = (total - current) / speed if speed > 0 else None
+        progress = current / total * 100 if total > 0 else None
         payload['status'] = 'processing'
         payload['progress'] = progress
         payload['remainingTime'] = remaining_time
         payload['speed'] = speed
         report_status()
 
-    try:
-        processing_activities.append(payload['id'])
-        civitai.load_resource(resource, on_progress)
-        if payload['status'] != 'canceled':
-            payload['status'] = 'success'
-    except Exception as e:
-        log(e)
-        if payload['status'] != 'canceled':
-            payload['status'] = 'error'
-            payload['error'] = 'Failed to download resource'
-
-    processing_activities.remove(payload['id'])
-    report_status(True)
-    send_resources()
+    def download():
+        payload.pop('queuePosition', None)
+        report_status(True)
+        try:
+            civitai.load_resource(resource, on_progress)
+            if payload['status'] != 'canceled':
+                payload['status'] = 'success'
+        except Exception as e:
+            log(e)
+            if payload['status'] != 'canceled':
+                payload['status'] = 'error'
+                payload['error'] = 'Failed to download resource'
+
+        processing_activities.remove(payload['id'])
+        report_status(True)
+        send_resources()
+
+    def on_queue_position(position: int):
+        payload['queuePosition'] = position
+        report_status(True)
+
+    def on_dequeued():
+        processing_activities.remove(payload['id'])
+        payload.pop('queuePosition', None)
+        payload['status'] = 'canceled'
+        report_status(True)
+
+    # Downloads run on the scheduler so the socket.io event thread is free for the next command
+    processing_activities.append(payload['id'])
+    priority = payload.get('priority', scheduler.PRIORITY_NORMAL)
+    civitai.download_scheduler.submit(payload['id'], download, priority, on_queue_position, on_dequeued)
 
 def on_activities_cancel(payload: CommandActivitiesCancel):
     activity_id = payload['activityId']
     if activity_id not in processing_activities:
         payload['status'] = 'error'
         payload['error'] = 'Activity not found or already completed'
+    elif civitai.download_scheduler.cancel(activity_id):
+        payload['status'] = 'success'
     else:
         should_cancel_activity.append(activity_id)
+        if payload.get('keepPartial', False): keep_partial_activity.append(activity_id)
         payload['status'] = 'success'
 
     command_response(payload)
 
 def on_resources_remove(payload: CommandResourcesRemove):
-    try:
-        civitai.remove_resource(payload['resource'])
-        payload['status'] = 'success'
-    except Exception as e:
-        log(e)
-        payload['status'] = 'error'
-        payload['error'] = 'Failed to remove resource'
+    def remove():
+        try:
+            civitai.remove_resource(payload['resource'])
+            payload['status'] = 'success'
+        except Exception as e:
+            log(e)
+            payload['status'] = 'error'
+            payload['error'] = 'Failed to remove resource'
+
+        command_response(payload, history=True)
+        send_resources()
 
-    command_response(payload, history=True)
-    send_resources()
+    # Finding the file may mean hashing it, which shouldn't hold up the socket.io event thread
+    threading.Thread(target=remove, daemon=True).start()
 
 def on_image_txt2img(payload: CommandImageTxt2Img):
     try:
@@ -0,0 +1,118 @@
+import threading
+from typing import Dict, Iterable, List
+
+class ResourceLookup:
+    """Dictionary indexes over the resource list: by SHA256, by 10 character short hash and by (type, name).
+
+    A lookup is never changed once it's published. `derive` makes the next one by removing and adding the
+    resources that changed. It copies the top level of each index, but of the buckets only those it touches, so
+    callers should batch their changes rather than derive once per resource. Lookups return resources in the order
+    they were added.
+    """
+    def __init__(self, base: 'ResourceLookup' = None):
+        self.by_hash: Dict[str, Dict[int, dict]] = dict(base.by_hash) if base else {}
+        self.by_short_hash: Dict[str, Dict[int, dict]] = dict(base.by_short_hash) if base else {}
+        self.by_name: Dict[tuple, Dict[int, dict]] = dict(base.by_name) if base else {}
+        self.pending: Dict[str, Dict[int, dict]] = dict(base.pending) if base else {}
+        self.copied = set()
+
+    def derive(self, removed: Iterable[dict], added: Iterable[dict]) -> 'ResourceLookup':
+        derived = ResourceLookup(self)
+        derived.remove(removed)
+        derived.add(added)
+        derived.copied = set()
+        return derived
+
+    def bucket(self, index: dict, key):
+        # Buckets are shared with the lookup this one was derived from until they're first changed
+        bucket = index.get(key)
+        if bucket is not None and (id(index), key) in self.copied: return bucket
+        self.copied.add((id(index), key))
+        bucket = dict(bucket) if bucket is not None else {}
+        index[key] = bucket
+        return bucket
+
+    def link(self, index: dict, key, resource: dict):
+        self.bucket(index, key)[id(resource)] = resource
+
+    def unlink(self, index: dict, key, resource: dict):
+        if key not in index: return
+        bucket = self.bucket(index, key)
+        bucket.pop(id(resource), None)
+        if len(bucket) == 0: del index[key]
+
+    def link_hash(self, resource: dict, hash: str):
+        if hash is None: return
+        self.link(self.by_hash, hash, resource)
+        self.link(self.by_short_hash, hash[:10], resource)
+
+    def unlink_hash(self, resource: dict, hash: str):
+        if hash is None: return
+        self.unlink(self.by_hash, hash, resource)
+        self.unlink(self.by_short_hash, hash[:10], resource)
+
+    def add(self, resources: Iterable[dict]):
+        for resource in resources:
+            self.link_hash(resource, resource.get('hash'))
+            self.link(self.by_name, (resource['type'], resource['name']), resource)
+            if resource.get('hashPending'): self.link(self.pending, resource.get('path'), resource)
+
+    def remove(self, resources: Iterable[dict]):
+        for resource in resources:
+            self.unlink_hash(resource, resource.get('hash'))
+            self.unlink(self.by_name, (resource['type'], resource['name']), resource)
+            if resource.get('hashPending'): self.unlink(self.pending, resource.get('path'), resource)
+
+    def find_hash(self, hash: str) -> List[dict]:
+        return list(self.by_hash.get(hash.lower(), {}).values())
+
+    def find_short_hash(self, short_hash: str) -> List[dict]:
+        return list(self.by_short_hash.get(short_hash.lower()[:10], {}).values())
+
+    def find_name(self, type: str, name: str) -> List[dict]:
+        return list(self.by_name.get((type, name), {}).values())
+
+    def find_pending(self, types: List[str] = None) -> List[dict]:
+        """Resources still waiting on their SHA256, optionally only those of `types`."""
+        return [r for bucket in self.pending.values() for r in bucket.values() if types is None or r['type'] in types]
+
+    def find_pending_path(self, path: str) -> List[dict]:
+        """Resources of the file at `path` still waiting on its SHA256."""
+        return list(self.pending.get(path, {}).values())
+
+class CheckpointLookup:
+    """Index of webui checkpoint infos by SHA256, short hash and legacy hash.
+
+    The webui fills in checkpoint hashes lazily and rebuilds its list in place, so a miss or a stale hit
+    rebuilds the index from `get_checkpoints()`, a dict of checkpoint infos by title, once before giving up.
+    """
+    hash_fields = ['sha256', 'shorthash', 'hash']
+
+    def __init__(self, get_checkpoints):
+        self.get_checkpoints = get_checkpoints
+        self.lock = threading.Lock()
+        self.by_hash = {}
+
+    def rebuild(self):
+        by_hash = {}
+        for info in list(self.get_checkpoints().values()):
+            for field in self.hash_fields:
+                value = getattr(info, field, None)
+                if value: by_hash.setdefault(value, info)
+        with self.lock:
+            self.by_hash = by_hash
+
+    def lookup(self, hash: str):
+        with self.lock:
+            info = self.by_hash.get(hash)
+        if info is None: return None
+        # Still listed and still known by this hash
+        if self.get_checkpoints().get(info.title) is not info: return None
+        if not any(getattr(info, field, None) == hash for field in self.hash_fields): return None
+        return info
+
+    def find(self, hash: str):
+        info = self.lookup(hash)
+        if info is not None: return info
+        self.rebuild()
+        return self.lookup(hash)
@@ -0,0 +1,93 @@
+from typing import List
+import json
+from pathlib import Path
+
+import civitai.lib as civitai
+
+from modules import shared
+
+#region Info
+actionable_types = ['LORA', 'LoCon', 'Hypernetwork', 'TextualInversion', 'Checkpoint']
+
+def get_missing_info(resources: List[dict]):
+    """Resources that should get an info file but don't have one yet."""
+    resources = [r for r in resources if r['type'] in actionable_types]
+    return [r for r in resources if r['hasInfo'] is False]
+
+def write_info(missing_info: List[dict], results: List[dict]):
+    """Write info files for `missing_info` from model versions returned by the by-hash API."""
+    hashes = [r['hash'] for r in missing_info]
+
+    with civitai.tracing.span('write_info') as span:
+        # update the resources with the new info
+        updated = 0
+        for r in results:
+            if (r is None):
+                continue
+
+            for file in r['files']:
+                if not 'hashes' in file or not 'SHA256' in file['hashes']:
+                    continue
+                file_hash = file['hashes']['SHA256']
+                if file_hash.lower() not in hashes:
+                    continue
+
+                if "SD 1" in r['baseModel']:
+                    sd_version = "SD1"
+                elif "SD 2" in r['baseModel']:
+                    sd_version = "SD2"
+                elif "SDXL" in r['baseModel']:
+                    sd_version = "SDXL"
+                else:
+                    sd_version = "unknown"
+                data = {
+                    "description": r['description'],
+                    "sd version": sd_version,
+                    "activation text": ", ".join(r['trainedWords']),
+                    "preferred weight": 0.8,
+                    "notes": "",
+                }
+
+                matches = [resource for resource in missing_info if file_hash.lower() == resource['hash']]
+                if len(matches) == 0:
+                    continue
+
+                for resource in matches:
+                    Path(resource['path']).with_suffix(".json").write_text(json.dumps(data, indent=4))
+                updated += 1
+
+        span.set(items=updated)
+    civitai.log(f"Updated {updated} info files")
+#endregion
+
+#region Previews
+previewable_types = ['LORA', 'LoCon', 'Hypernetwork', 'TextualInversion', 'Checkpoint']
+
+def get_missing_previews(resources: List[dict]):
+    """Resources that should get a preview image but don't have one yet."""
+    resources = [r for r in resources if r['type'] in previewable_types]
+    return [r for r in resources if r['hasPreview'] is False]
+
+def write_previews(missing_previews: List[dict], results: List[dict]):
+    """Download previews for `missing_previews` from model versions returned by the by-hash API."""
+    nsfw_previews = shared.opts.data.get('civitai_nsfw_previews', True)
+    hashes = [r['hash'] for r in missing_previews]
+
+    # collect the new previews and download them in parallel
+    previews = []
+    for r in results:
+        if (r is None): continue
+
+        for file in r['files']:
+            if not 'hashes' in file or not 'SHA256' in file['hashes']: continue
+            hash = file['hashes']['SHA256']
+            if hash.lower() not in hashes: continue
+            images = r['images']
+            if (nsfw_previews is False): images = [i for i in images if i['nsfw'] is False]
+            if (len(images) == 0): continue
+            image_url = images[0]['url']
+            previews.append((hash, image_url))
+
+    updated = civitai.update_resource_previews(previews)
+    civitai.log(f"Updated {updated} preview images")
+#endregion
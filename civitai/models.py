@@ -61,6 +61,7 @@ class CommandResourcesList(Command):
 class CommandResourcesAdd(Command):
     type: CommandTypes = Field(default=CommandTypes.ResourcesAdd, title="Type", description="The type of command to execute.")
     resource: ResourceRequest = Field(default=[], title="Resource", description="The resources to add.")
+    priority: str = Field(default="normal", title="Priority", description="Download priority: high, normal or low.")
 
 class ResourceCancelRequest(BaseModel):
     type: ResourceTypes = Field(default=None, title="Type", description="The type of the resource to remove.")
@@ -68,6 +69,8 @@ class ResourceCancelRequest(BaseModel):
 
 class CommandActivitiesCancel(Command):
     type: CommandTypes = Field(default=CommandTypes.ActivitiesCancel, title="Type", description="The type of command to execute.")
+    activityId: str = Field(default=None, title="Activity ID", description="The ID of the activity to cancel.")
+    keepPartial: bool = Field(default=False, title="Keep Partial", description="Keep the partially downloaded file so the download can be resumed later.")
 
 class ResourceRemoveRequest(BaseModel):
     type: ResourceTypes = Field(default=None, title="Type", description="The type of the resource to remove.")
@@ -0,0 +1,54 @@
+import threading
+import time
+
+#region shared variables
+# Longest single sleep, so rate changes and cancellations are picked up quickly
+max_wait = 0.1
+min_chunk_size = 16 * 1024
+#endregion
+
+class TokenBucket:
+    """Token bucket shared by every transfer that draws on the same budget.
+
+    `rate` is in bytes per second and 0 means unlimited. Callers report bytes after they've read them,
+    which may put the bucket in debt. The next caller then waits until it's paid off. Changing the rate
+    applies to transfers already in flight.
+    """
+    def __init__(self, rate: float = 0):
+        self.rate = rate
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        # Must be called with the lock held. Allows at most a second of burst.
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.refill()
+            self.rate = max(0, rate)
+            if self.rate == 0: self.tokens = 0.0
+
+    def chunk_size(self, default: int):
+        """Read size that keeps a limited transfer from stalling for long between reads."""
+        if self.rate <= 0: return default
+        return int(max(min_chunk_size, min(default, self.rate / 4)))
+
+    def consume(self, count: int):
+        if self.rate <= 0: return
+
+        with self.lock:
+            self.refill()
+            self.tokens -= count
+
+        while True:
+            with self.lock:
+                if self.rate <= 0: return
+                self.refill()
+                if self.tokens >= 0: return
+                wait = min(max_wait, -self.tokens / self.rate)
+            time.sleep(wait)
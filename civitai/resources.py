@@ -0,0 +1,91 @@
+import time
+from typing import Iterable, List, Tuple
+
+from civitai.lookup import ResourceLookup
+
+class Resource:
+    """One local resource file. Slotted to keep tens of thousands of them small, and read like the dicts it
+    replaced (`resource['hash']`, `resource.get('path')`) so existing code keeps working.
+
+    Records are shared between snapshots and never changed, `replace` makes an updated copy.
+    """
+    __slots__ = ('type', 'name', 'hash', 'fingerprint', 'path', 'hasPreview', 'previewFile', 'hasInfo', 'hashPending', 'downloading')
+    # Only sent along when set, like the keys the resource dicts used to leave out
+    optional_fields = ('fingerprint', 'path', 'hasPreview', 'previewFile', 'hasInfo', 'hashPending', 'downloading')
+
+    def __init__(self, type: str, name: str, hash: str = None, fingerprint: str = None, path: str = None, hasPreview: bool = None, previewFile: str = None, hasInfo: bool = None, hashPending: bool = None, downloading: bool = None):
+        self.type = type
+        self.name = name
+        self.hash = hash
+        self.fingerprint = fingerprint
+        self.path = path
+        self.hasPreview = hasPreview
+        self.previewFile = previewFile
+        self.hasInfo = hasInfo
+        self.hashPending = hashPending
+        self.downloading = downloading
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__: raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def replace(self, **values) -> 'Resource':
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields.update(values)
+        return Resource(**fields)
+
+    def to_dict(self):
+        data = {'type': self.type, 'name': self.name, 'hash': self.hash}
+        for field in self.optional_fields:
+            value = getattr(self, field)
+            if value is not None: data[field] = value
+        return data
+
+    def __repr__(self):
+        return f'Resource({self.to_dict()})'
+
+class ResourceSnapshot:
+    """An immutable view of the resource list with its lookup indexes.
+
+    Readers take the current snapshot and use it without locking. Writers build the next one with `derive` and
+    swap it in, so a reader never sees a half-finished refresh.
+    """
+    def __init__(self, records: Iterable[Resource] = (), lookup: ResourceLookup = None, version: int = 0):
+        self.records = tuple(records)
+        self.lookup = lookup if lookup is not None else ResourceLookup().derive([], self.records)
+        self.version = version
+        self.created = time.time()
+        self.serialized = None
+
+    def derive(self, removed: List[Resource], added: List[Resource]) -> 'ResourceSnapshot':
+        """The next snapshot, without `removed` and with `added` appended."""
+        removed_ids = {id(r) for r in removed}
+        records = [r for r in self.records if id(r) not in removed_ids] if len(removed_ids) > 0 else list(self.records)
+        return ResourceSnapshot(records + list(added), self.lookup.derive(removed, added), self.version + 1)
+
+    def replace(self, replaced: List[Tuple[Resource, Resource]]) -> 'ResourceSnapshot':
+        """The next snapshot, with the records of (old, new) pairs swapped in place."""
+        new_records = {id(old): new for old, new in replaced}
+        records = [new_records.get(id(r), r) for r in self.records]
+        return ResourceSnapshot(records, self.lookup.derive([old for old, _ in replaced], [new for _, new in replaced]), self.version + 1)
+
+    def of_types(self, types: List[str]) -> List[Resource]:
+        return [r for r in self.records if r.type in types]
+
+    def to_dicts(self) -> List[dict]:
+        """The records as dicts for sending, built once per snapshot."""
+        if self.serialized is None: self.serialized = [r.to_dict() for r in self.records]
+        return self.serialized
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
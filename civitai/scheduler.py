@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import threading
+from typing import Callable, Dict, List
+
+#region shared variables
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+priorities = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL, 'low': PRIORITY_LOW}
+#endregion
+
+def get_priority(value):
+    """Accept either a priority number or one of the names in `priorities`."""
+    if isinstance(value, int): return value
+    return priorities.get(str(value).lower(), PRIORITY_NORMAL)
+
+class Job:
+    def __init__(self, id: str, fn: Callable, priority: int, on_position: Callable[[int], None] = None, on_cancel: Callable[[], None] = None):
+        self.id = id
+        self.fn = fn
+        self.priority = priority
+        self.on_position = on_position
+        self.on_cancel = on_cancel
+        self.position = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout: float = None):
+        """Block until the job has run, re-raising anything it raised."""
+        self.done.wait(timeout)
+        if self.error is not None: raise self.error
+
+class Scheduler:
+    """Run jobs on background threads, at most `concurrency` at a time, lowest priority number first.
+
+    Jobs with the same priority run in the order they were submitted. Queued jobs are told their
+    1-based queue position whenever it changes.
+    """
+    def __init__(self, concurrency: int = 2):
+        self.concurrency = max(1, concurrency)
+        self.lock = threading.Lock()
+        self.queue: List = []
+        self.running: Dict[str, Job] = {}
+        self.counter = itertools.count()
+
+    def submit(self, id: str, fn: Callable, priority=PRIORITY_NORMAL, on_position: Callable[[int], None] = None, on_cancel: Callable[[], None] = None):
+        job = Job(id, fn, get_priority(priority), on_position, on_cancel)
+        with self.lock:
+            heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+            self.dispatch()
+        self.notify_positions()
+        return job
+
+    def cancel(self, id: str):
+        """Remove a job that hasn't started yet. Returns False if it's running or unknown."""
+        with self.lock:
+            found = [entry for entry in self.queue if entry[2].id == id]
+            if len(found) == 0: return False
+            self.queue.remove(found[0])
+            heapq.heapify(self.queue)
+        job = found[0][2]
+        if job.on_cancel is not None: job.on_cancel()
+        job.done.set()
+        self.notify_positions()
+        return True
+
+    def set_concurrency(self, concurrency: int):
+        # Lowering the limit lets running jobs finish, it only holds back new ones
+        with self.lock:
+            self.concurrency = max(1, concurrency)
+            self.dispatch()
+        self.notify_positions()
+
+    def position(self, id: str):
+        with self.lock:
+            for i, (_, _, job) in enumerate(sorted(self.queue)):
+                if job.id == id: return i + 1
+        return None
+
+    def is_queued(self, id: str):
+        return self.position(id) is not None
+
+    def is_running(self, id: str):
+        with self.lock:
+            return id in self.running
+
+    def dispatch(self):
+        # Must be called with the lock held
+        while len(self.running) < self.concurrency and len(self.queue) > 0:
+            _, _, job = heapq.heappop(self.queue)
+            job.position = None
+            self.running[job.id] = job
+            threading.Thread(target=self.run_job, args=(job,), daemon=True).start()
+
+    def run_job(self, job: Job):
+        try:
+            job.fn()
+        except BaseException as e:
+            job.error = e
+        finally:
+            with self.lock:
+                self.running.pop(job.id, None)
+                self.dispatch()
+            job.done.set()
+            self.notify_positions()
+
+    def notify_positions(self):
+        with self.lock:
+            queued = [job for _, _, job in sorted(self.queue)]
+        for i, job in enumerate(queued):
+            if job.position == i + 1: continue
+            job.position = i + 1
+            if job.on_position is not None: job.on_position(job.position)
@@ -0,0 +1,156 @@
+import collections
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+#region shared variables
+enabled = False
+# Events kept for export, oldest dropped first
+max_events = 100000
+# Durations per span name kept for the rolling percentiles
+window_size = 1000
+# Span arguments added up in the summary
+summed_args = ['bytes', 'items', 'retries']
+
+events = collections.deque(maxlen=max_events)
+summaries: Dict[str, 'Summary'] = {}
+summaries_lock = threading.Lock()
+started = time.perf_counter()
+#endregion
+
+class Summary:
+    """Rolling statistics for one span name: totals since the last reset, percentiles over the recent window."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.counters: Dict[str, float] = {}
+        self.recent = collections.deque(maxlen=window_size)
+
+    def add(self, duration: float, args: dict, error: bool):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if error: self.errors += 1
+        self.recent.append(duration)
+        for key in summed_args:
+            value = args.get(key)
+            if value is not None: self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_dict(self):
+        recent = sorted(self.recent)
+        def percentile(share):
+            return recent[min(len(recent) - 1, int(len(recent) * share))] if recent else None
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count > 0 else None,
+            'max': self.max,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'errors': self.errors,
+            **self.counters,
+        }
+
+class Span:
+    """A timed section, used as a context manager. `set` attaches arguments such as byte and item counts,
+    those in `summed_args` are added up in the summary."""
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None: self.args['error'] = exc_type.__name__
+        record(self.name, self.category, self.start, end - self.start, self.args, exc_type is not None)
+        return False
+
+class NullSpan:
+    """Stands in for Span while tracing is off, so instrumented code costs one check and nothing else."""
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+null_span = NullSpan()
+
+def span(name: str, category: str = 'civitai', **args):
+    if not enabled: return null_span
+    return Span(name, category, args)
+
+def record(name: str, category: str, start: float, duration: float, args: dict, error: bool = False):
+    thread = threading.current_thread()
+    # deque.append is atomic, so recording an event needs no lock
+    events.append((name, category, start, duration, thread.ident, thread.name, args))
+    with summaries_lock:
+        summary = summaries.get(name)
+        if summary is None: summary = summaries[name] = Summary()
+        summary.add(duration, args, error)
+
+def set_enabled(value: bool):
+    global enabled
+    enabled = bool(value)
+
+def reset():
+    global started
+    events.clear()
+    with summaries_lock:
+        summaries.clear()
+    started = time.perf_counter()
+
+def get_summary():
+    """Statistics per span name, slowest total first. Times are in seconds."""
+    with summaries_lock:
+        items = [(name, summary.to_dict()) for name, summary in summaries.items()]
+    return dict(sorted(items, key=lambda item: item[1]['total'], reverse=True))
+
+#region Chrome Trace
+def to_chrome_trace():
+    """The recorded spans in Chrome's trace event format, for chrome://tracing or ui.perfetto.dev."""
+    pid = os.getpid()
+    trace = []
+    threads = {}
+    for name, category, start, duration, tid, thread_name, args in list(events):
+        threads[tid] = thread_name
+        trace.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - started) * 1e6,
+            'dur': duration * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        })
+    for tid, thread_name in threads.items():
+        trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+def export_chrome_trace(path: str):
+    trace = to_chrome_trace()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(trace, f, default=str)
+    os.replace(tmp_path, path)
+    return len(trace['traceEvents'])
+#endregion
@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Set
+
+#region shared variables
+debounce_time = 2
+max_debounce_time = 15
+poll_interval = 30
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+watch_mask = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+event_header = struct.Struct('iIII')
+
+# Reported instead of a path when the backend lost track of what changed
+EVERYTHING = '*'
+#endregion
+
+class Watcher:
+    """Watch folder trees and report changed paths to `on_change`, debounced so a burst arrives as one call.
+
+    Subclasses implement `run`, calling `notify` with each changed path.
+    """
+    def __init__(self, folders: List[str], on_change: Callable[[Set[str]], None]):
+        self.folders = list(dict.fromkeys(os.path.abspath(f) for f in folders))
+        self.on_change = on_change
+        self.pending: Set[str] = set()
+        self.first_event = 0
+        self.last_event = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.run, daemon=True), threading.Thread(target=self.debounce, daemon=True)]
+        for t in self.threads: t.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def notify(self, path: str):
+        with self.lock:
+            now = time.time()
+            if len(self.pending) == 0: self.first_event = now
+            self.last_event = now
+            self.pending.add(path)
+
+    def debounce(self):
+        while not self.stop_event.wait(0.5):
+            with self.lock:
+                if len(self.pending) == 0: continue
+                now = time.time()
+                if now - self.last_event < debounce_time and now - self.first_event < max_debounce_time: continue
+                paths = self.pending
+                self.pending = set()
+            try:
+                self.on_change(paths)
+            except Exception as e:
+                print(f'Civitai: Failed to handle folder changes: {e}')
+
+    def run(self):
+        raise NotImplementedError()
+
+#region Polling
+def snapshot(folder: str, files: Dict[str, tuple], visited: Set[tuple] = None):
+    """Record (size, mtime) of everything under `folder`, using the stat results os.scandir already has."""
+    if visited is None: visited = set()
+    try:
+        st = os.stat(folder)
+    except OSError:
+        return
+    # Don't loop forever on symlinked directories
+    if (st.st_dev, st.st_ino) in visited: return
+    visited.add((st.st_dev, st.st_ino))
+
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith('.'): continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            snapshot(entry.path, files, visited)
+        else:
+            files[entry.path] = (st.st_size, st.st_mtime)
+
+class PollingWatcher(Watcher):
+    """Fallback for platforms without inotify: diff a stat snapshot of the folders every `poll_interval` seconds."""
+    def take_snapshot(self):
+        files = {}
+        visited = set()
+        for folder in self.folders: snapshot(folder, files, visited)
+        return files
+
+    def run(self):
+        previous = self.take_snapshot()
+        while not self.stop_event.wait(poll_interval):
+            current = self.take_snapshot()
+            for path in set(previous) | set(current):
+                if previous.get(path) != current.get(path): self.notify(path)
+            previous = current
+#endregion
+
+#region Inotify
+def load_libc():
+    if not sys.platform.startswith('linux'): return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class InotifyWatcher(PollingWatcher):
+    """Linux watcher. inotify isn't recursive, so every directory in the trees gets its own watch.
+
+    Falls back to polling when inotify runs out of watches (fs.inotify.max_user_watches).
+    """
+    def __init__(self, folders: List[str], on_change: Callable[[Set[str]], None], libc):
+        super().__init__(folders, on_change)
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: Dict[int, str] = {}
+
+    def add_watch(self, folder: str, visited: Set[tuple] = None):
+        """Watch `folder` and every directory under it. Raises OSError when inotify is out of watches."""
+        if visited is None: visited = set()
+        pending = [folder]
+        while len(pending) > 0:
+            dir = pending.pop()
+            try:
+                st = os.stat(dir)
+            except OSError:
+                continue
+
+            # Don't loop forever on symlinked directories
+            if (st.st_dev, st.st_ino) in visited: continue
+            visited.add((st.st_dev, st.st_ino))
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), watch_mask)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOSPC, errno.ENOMEM): raise OSError(error, f'Could not watch {dir}: {os.strerror(error)}')
+                print(f'Civitai: Could not watch {dir}: {os.strerror(error)}')
+                continue
+            self.watches[wd] = dir
+
+            try:
+                entries = list(os.scandir(dir))
+            except OSError:
+                continue
+            for entry in reversed(entries):
+                if entry.name.startswith('.'): continue
+                try:
+                    if entry.is_dir(): pending.append(entry.path)
+                except OSError:
+                    continue
+
+    def handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self.notify(EVERYTHING)
+            return
+
+        dir = self.watches.get(wd)
+        if dir is None: return
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return
+
+        path = os.path.join(dir, name) if name else dir
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO): self.add_watch(path)
+        self.notify(path)
+
+    def run(self):
+        watching = False
+        try:
+            visited = set()
+            for folder in self.folders:
+                if os.path.isdir(folder): self.add_watch(folder, visited)
+
+            watching = True
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([self.fd], [], [], 1)
+                if len(readable) == 0: continue
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+
+                offset = 0
+                while offset + event_header.size <= len(data):
+                    wd, mask, _, length = event_header.unpack_from(data, offset)
+                    offset += event_header.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    self.handle(wd, mask, name)
+        except OSError as e:
+            print(f'Civitai: {e}, polling for changes instead')
+        finally:
+            os.close(self.fd)
+
+        if self.stop_event.is_set(): return
+        # Changes since the last event may have been missed
+        if watching: self.notify(EVERYTHING)
+        super().run()
+#endregion
+
+def create_watcher(folders: List[str], on_change: Callable[[Set[str]], None]) -> Watcher:
+    """An inotify watcher where available, otherwise a polling one."""
+    libc = load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatcher(folders, on_change, libc)
+        except OSError as e:
+            print(f'Civitai: inotify unavailable ({e}), polling for changes instead')
+    return PollingWatcher(folders, on_change)
@@ -18,5 +18,14 @@ def civitaiAPI(_: gr.Blocks, app: FastAPI):
     @app.get('/civitai/v1/alpha-link-status')
     def alpha_link_status():
         return { "connected": get_link_status() }
+    @app.get('/civitai/v1/hash-status')
+    def hash_status():
+        return { **civitai.hash_queue.progress(), "throughput": civitai.hashing.get_stats() }
+    @app.get('/civitai/v1/trace')
+    def trace():
+        return civitai.tracing.to_chrome_trace()
+    @app.get('/civitai/v1/trace-summary')
+    def trace_summary():
+        return { "enabled": civitai.tracing.enabled, "spans": civitai.tracing.get_summary() }
 script_callbacks.on_app_started(civitaiAPI)
 civitai.log("API loaded")
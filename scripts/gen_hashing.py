@@ -1,6 +1,8 @@
+import collections
 import json
 import re
 import os
+import threading
 
 import civitai.lib as civitai
 from modules import script_callbacks, sd_vae, shared
@@ -9,69 +11,198 @@ additional_network_type_map = {
     'lora': 'LORA',
     'hypernet': 'Hypernetwork'
 }
-additional_network_pattern = r'<(lora|hypernet):([a-zA-Z0-9_\.\-\s]+):([0-9.]+)(?:[:].*)?>'
-model_hash_pattern = r'Model hash: ([0-9a-fA-F]{10})'
-
-# Automatically pull model with corresponding hash from Civitai
-def add_resource_hashes(params):
-    if 'parameters' not in params.pnginfo: return
-
-    hashify_resources = shared.opts.data.get('civitai_hashify_resources', True)
-    if not hashify_resources: return
-
-    lines = params.pnginfo['parameters'].split('\n')
-    generation_params = lines.pop()
-    prompt_parts = '\n'.join(lines).split('Negative prompt:')
-    prompt, negative_prompt = [s.strip() for s in prompt_parts[:2] + ['']*(2-len(prompt_parts))]
-
-    hashed_prompt = prompt
-    hashed_negative_prompt = negative_prompt
-
-    resources = civitai.load_resource_list([])
+additional_network_pattern = re.compile(r'<(lora|hypernet):([a-zA-Z0-9_\.\-\s]+):([0-9.]+)(?:[:].*)?>')
+model_hash_pattern = re.compile(r'Model hash: ([0-9a-fA-F]{10})')
+# Embedding names count when they stand alone, between these characters or the ends of the prompt
+embedding_start = r'(?<![^\s:(|\[\]])'
+embedding_end = r'(?![^\s:)|\[\]\,])'
+
+def trie_pattern(names):
+    """An alternation of `names` shaped as a trie, so the regex engine follows one branch per character
+    instead of trying every name at every position. Longer names are tried first."""
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name: node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+        if len(branches) == 0: return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if end: pattern = '(?:' + pattern + ')?'
+        return pattern
+
+    return build(trie)
+
+class PromptMatcher:
+    """Everything add_resource_hashes looks up, built once per resource snapshot.
+
+    Embeddings are found with one combined pattern instead of a pattern per embedding. Names that are a prefix of a
+    longer match starting at the same place are checked separately, since the pattern only reports the longest.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+        self.embeddings = {}
+        self.positions = {}
+        for i, r in enumerate(snapshot):
+            if r.type != 'TextualInversion': continue
+            self.embeddings.setdefault(r.name.lower(), []).append(r)
+            self.positions[id(r)] = i
+        names = list(self.embeddings)
+        self.embedding_pattern = re.compile(embedding_start + '(?=(' + trie_pattern(names) + ')' + embedding_end + ')', re.IGNORECASE) if len(names) > 0 else None
+        name_set = set(names)
+        self.prefixes = {name: [name[:i] for i in range(1, len(name)) if name[:i] in name_set] for name in names}
+
+        # <lora:name:weight> matches a resource by its name or the part of it before the first '-'
+        self.networks = {}
+        for r in snapshot:
+            if r.type not in additional_network_type_map.values(): continue
+            name = r.name.lower()
+            self.networks.setdefault((r.type, name), r)
+            self.networks.setdefault((r.type, name.split('-')[0]), r)
+
+        self.checkpoints = {}
+        for r in snapshot:
+            if r.type == 'Checkpoint' and r.hash is not None: self.checkpoints.setdefault(r.hash[:10], r)
+
+    def find_embeddings(self, *texts: str):
+        """The embeddings used in any of `texts`, in resource list order."""
+        found = set()
+        for text in texts:
+            if self.embedding_pattern is None or len(text) == 0: continue
+            for match in self.embedding_pattern.finditer(text):
+                name = match.group(1).lower()
+                found.add(name)
+                for prefix in self.prefixes[name]:
+                    end = match.start() + len(prefix)
+                    if end == len(text) or re.match(r'[\s:)|\[\],]', text[end]): found.add(prefix)
+        return sorted((r for name in found for r in self.embeddings[name]), key=lambda r: self.positions[id(r)])
+
+    def find_network(self, type: str, name: str):
+        return self.networks.get((type, name.lower()))
+
+    def find_checkpoint(self, short_hash: str):
+        return self.checkpoints.get(short_hash.lower())
+
+prompt_matcher = None
+def get_matcher(snapshot):
+    global prompt_matcher
+    current = prompt_matcher
+    if current is None or current.snapshot is not snapshot:
+        current = prompt_matcher = PromptMatcher(snapshot)
+    return current
+
+def compute_resource_hashes(prompt: str, negative_prompt: str, model_hash: str, vae_name: str, resources, complete=True):
+    """The resource hashes to include in the image metadata, as the `Hashes:` JSON or None.
+
+    Matched resources still waiting on their hash are hashed first if `complete`, otherwise they're left out.
+    """
+    matcher = get_matcher(resources)
     resource_hashes = {}
+    def ensure_hashes(matches):
+        return civitai.ensure_hashes(matches) if complete else matches
 
     # Hash the VAE
-    if hashify_resources and sd_vae.loaded_vae_file is not None:
-        vae_name = os.path.splitext(sd_vae.get_filename(sd_vae.loaded_vae_file))[0]
-        vae_matches = [r for r in resources if r['type'] == 'VAE' and r['name'] == vae_name]
-        if len(vae_matches) > 0:
+    if vae_name is not None:
+        vae_matches = ensure_hashes(resources.lookup.find_name('VAE', vae_name)[:1])
+        if len(vae_matches) > 0 and vae_matches[0]['hash'] is not None:
             short_hash = vae_matches[0]['hash'][:10]
             resource_hashes['vae'] = short_hash
 
 
     # Check for embeddings in prompt
-    embeddings = [r for r in resources if r['type'] == 'TextualInversion']
-    for embedding in embeddings:
+    for embedding in ensure_hashes(matcher.find_embeddings(prompt, negative_prompt)):
         embedding_name = embedding['name']
-        embedding_pattern = re.compile(r'(?<![^\s:(|\[\]])' + re.escape(embedding_name) + r'(?![^\s:)|\[\]\,])', re.MULTILINE | re.IGNORECASE)
-
-        match_prompt = embedding_pattern.search(prompt)
-        match_negative = embedding_pattern.search(negative_prompt)
-        if not match_prompt and not match_negative: continue
-
+        if embedding['hash'] is None: continue
         short_hash = embedding['hash'][:10]
         resource_hashes[f'embed:{embedding_name}'] = short_hash
 
     # Check for additional networks in prompt
-    network_matches = re.findall(additional_network_pattern, prompt)
+    network_matches = additional_network_pattern.findall(prompt)
     for match in network_matches:
         network_type, network_name, network_weight = match
         resource_type = additional_network_type_map[network_type]
-        matching_resource = [r for r in resources if r['type'] == resource_type and (r['name'].lower() == network_name.lower() or r['name'].lower().split('-')[0] == network_name.lower())]
-        if len(matching_resource) > 0:
+        matching_resource = matcher.find_network(resource_type, network_name)
+        matching_resource = ensure_hashes([matching_resource] if matching_resource is not None else [])
+        if len(matching_resource) > 0 and matching_resource[0]['hash'] is not None:
             short_hash = matching_resource[0]['hash'][:10]
             resource_hashes[f'{network_type}:{network_name}'] = short_hash
 
     # Check for model hash in generation parameters
-    model_match = re.search(model_hash_pattern, generation_params)
-    if hashify_resources and model_match:
-        model_hash = model_match.group(1)
-        matching_resource = [r for r in resources if r['type'] == 'Checkpoint' and r['hash'].startswith(model_hash)]
-        if len(matching_resource) > 0:
-            short_hash = matching_resource[0]['hash'][:10]
+    if model_hash is not None:
+        # The webui has hashed the checkpoint it generated with, so this is answered from its cache
+        if complete and matcher.find_checkpoint(model_hash) is None and len(resources.lookup.find_pending(['Checkpoint'])) > 0:
+            civitai.ensure_hashes(resources.lookup.find_pending(['Checkpoint']), compute=False)
+            matcher = get_matcher(civitai.get_resources())
+        matching_resource = matcher.find_checkpoint(model_hash)
+        if matching_resource is not None:
+            short_hash = matching_resource['hash'][:10]
             resource_hashes['model'] = short_hash
 
-    if len(resource_hashes) > 0:
-        params.pnginfo['parameters'] += f", Hashes: {json.dumps(resource_hashes)}"
+    if len(resource_hashes) == 0: return None
+    return json.dumps(resource_hashes)
+
+# Batches save the same prompt over and over, so results are remembered per prompt, model, VAE and resource list
+memo_size = 256
+memo = collections.OrderedDict()
+memo_lock = threading.Lock()
+memo_hits = 0
+memo_misses = 0
+memo_report_interval = 100
+
+def get_memo_stats():
+    with memo_lock:
+        total = memo_hits + memo_misses
+        return {'hits': memo_hits, 'misses': memo_misses, 'hitRate': memo_hits / total if total > 0 else None, 'size': len(memo), 'maxSize': memo_size}
+
+# Automatically pull model with corresponding hash from Civitai
+def add_resource_hashes(params):
+    global memo_hits, memo_misses
+    if 'parameters' not in params.pnginfo: return
+
+    hashify_resources = shared.opts.data.get('civitai_hashify_resources', True)
+    if not hashify_resources: return
+
+    with civitai.tracing.span('add_resource_hashes') as span:
+        lines = params.pnginfo['parameters'].split('\n')
+        generation_params = lines.pop()
+        prompt_parts = '\n'.join(lines).split('Negative prompt:')
+        prompt, negative_prompt = [s.strip() for s in prompt_parts[:2] + ['']*(2-len(prompt_parts))]
+
+        model_match = model_hash_pattern.search(generation_params)
+        model_hash = model_match.group(1) if model_match else None
+        vae_name = os.path.splitext(sd_vae.get_filename(sd_vae.loaded_vae_file))[0] if sd_vae.loaded_vae_file is not None else None
+
+        # Image saving never waits on a rescan, the last resource snapshot is good enough. Hashes can't be stored
+        # while a scan holds the resource index, so then the snapshot is used as it is and the result not kept
+        resources = civitai.get_resources()
+        complete = not civitai.is_scanning()
+        key = (prompt, negative_prompt, model_hash, vae_name, resources.version)
+        with memo_lock:
+            found = key in memo
+            if found:
+                memo.move_to_end(key)
+                hashes_json = memo[key]
+                memo_hits += 1
+            else:
+                memo_misses += 1
+            report = (memo_hits + memo_misses) % memo_report_interval == 0
+        if report:
+            stats = get_memo_stats()
+            civitai.log(f"Resource hashes for saved images: {stats['hits']} reused, {stats['misses']} computed")
+
+        if not found:
+            hashes_json = compute_resource_hashes(prompt, negative_prompt, model_hash, vae_name, resources, complete)
+            if complete:
+                with memo_lock:
+                    memo[key] = hashes_json
+                    if len(memo) > memo_size: memo.popitem(last=False)
+
+        span.set(cached=found, bytes=len(hashes_json) if hashes_json is not None else 0)
+        if hashes_json is not None:
+            params.pnginfo['parameters'] += f", Hashes: {hashes_json}"
 
 script_callbacks.on_before_image_saved(add_resource_hashes)
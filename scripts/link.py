@@ -1,10 +1,16 @@
 import gradio as gr
 
+import civitai.lib as civitai
 import civitai.link as link
 
 from modules import shared, script_callbacks
 
+# Hashes of newly found resources arrive in the background, send the completed list once they're all in
+def on_hashes_ready():
+    if link.is_connected(): link.send_resources()
+
 def connect_to_civitai(demo: gr.Blocks, app):
+    civitai.hashes_ready_function = on_hashes_ready
     key = shared.opts.data.get("civitai_link_key", None)
     # If key is empty or not set, don't connect to Civitai Link
     if not key: return
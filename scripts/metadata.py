@@ -0,0 +1,47 @@
+import gradio as gr
+import threading
+
+import civitai.lib as civitai
+from civitai.metadata import get_missing_info, write_info, get_missing_previews, write_previews
+
+from modules import script_callbacks, shared
+
+def load_metadata():
+    """Scan resources once and resolve every hash missing info or a preview in one by-hash pass."""
+    download_missing_info = shared.opts.data.get('civitai_download_triggers', True)
+    download_missing_previews = shared.opts.data.get('civitai_download_previews', True)
+    if not download_missing_info and not download_missing_previews:
+        return
+
+    civitai.log("Check resources for missing info files and preview images")
+    resources = civitai.load_resource_list()
+    missing_info = get_missing_info(resources) if download_missing_info else []
+    missing_previews = get_missing_previews(resources) if download_missing_previews else []
+    missing_info = [r for r in civitai.ensure_hashes(missing_info) if r['hash'] is not None]
+    missing_previews = [r for r in civitai.ensure_hashes(missing_previews) if r['hash'] is not None]
+    civitai.log(f"Found {len(missing_info)} resources missing info files and {len(missing_previews)} missing preview images")
+
+    hashes = list(dict.fromkeys([r['hash'] for r in missing_info + missing_previews]))
+    if len(hashes) == 0: return
+
+    try:
+        results = civitai.resolve_hashes(hashes)
+    except:
+        civitai.log("Failed to fetch info and preview images from Civitai")
+        return
+
+    if len(results) == 0:
+        civitai.log("No info or preview images found on Civitai")
+        return
+
+    civitai.log(f"Found {len(results)} hash matches")
+    if len(missing_info) > 0: write_info(missing_info, results)
+    if len(missing_previews) > 0: write_previews(missing_previews, results)
+
+# Automatically pull info and previews for resources with corresponding hashes from Civitai
+def start_load_metadata(demo: gr.Blocks, app):
+    civitai.refresh_metadata_function = load_metadata
+    thread = threading.Thread(target=load_metadata)
+    thread.start()
+
+script_callbacks.on_app_started(start_load_metadata)
@@ -1,6 +1,19 @@
+import gradio as gr
+
 from civitai.link import on_civitai_link_key_changed
+import civitai.lib as civitai
+import civitai.hashes as hashing
 from modules import shared, script_callbacks
 
+def on_download_concurrency_changed():
+    civitai.download_scheduler.set_concurrency(int(shared.opts.data.get('civitai_download_concurrency', 2)))
+
+def on_hash_workers_changed():
+    civitai.hash_queue.set_workers(int(shared.opts.data.get('civitai_hash_workers', 2)))
+
+def on_tracing_changed():
+    civitai.tracing.set_enabled(shared.opts.data.get('civitai_tracing', False))
+
 def on_ui_settings():
     section = ('civitai_link', "Civitai")
     shared.opts.add_option("civitai_link_key", shared.OptionInfo("", "Your Civitai Link Key", section=section, onchange=on_civitai_link_key_changed))
@@ -9,8 +22,19 @@ def on_ui_settings():
     shared.opts.add_option("civitai_download_previews", shared.OptionInfo(True, "Download missing preview images on startup", section=section))
     shared.opts.add_option("civitai_download_triggers", shared.OptionInfo(True, "Download missing activation triggers on startup", section=section))
     shared.opts.add_option("civitai_nsfw_previews", shared.OptionInfo(False, "Download NSFW (adult) preview images", section=section))
+    shared.opts.add_option("civitai_preview_size", shared.OptionInfo(512, "Maximum width and height of downloaded preview images", gr.Slider, {"minimum": 128, "maximum": 2048, "step": 64}, section=section))
+    shared.opts.add_option("civitai_preview_format", shared.OptionInfo("jpeg", "Format of downloaded preview images", gr.Radio, {"choices": ["jpeg", "webp", "png"]}, section=section))
     shared.opts.add_option("civitai_download_missing_models", shared.OptionInfo(True, "Download missing models upon reading generation parameters from prompt", section=section))
     shared.opts.add_option("civitai_hashify_resources", shared.OptionInfo(True, "Include resource hashes in image metadata (for resource auto-detection on Civitai)", section=section))
+    shared.opts.add_option("civitai_download_connections", shared.OptionInfo(4, "Connections to use per resource download", gr.Slider, {"minimum": 1, "maximum": 16, "step": 1}, section=section))
+    shared.opts.add_option("civitai_download_concurrency", shared.OptionInfo(2, "Resources to download at the same time", gr.Slider, {"minimum": 1, "maximum": 8, "step": 1}, section=section, onchange=on_download_concurrency_changed))
+    shared.opts.add_option("civitai_bandwidth_models", shared.OptionInfo(0, "Bandwidth limit for resource downloads in MB/s (0 = unlimited)", gr.Number, section=section, onchange=civitai.update_bandwidth_limits))
+    shared.opts.add_option("civitai_bandwidth_previews", shared.OptionInfo(0, "Bandwidth limit for preview images and Civitai API requests in MB/s (0 = unlimited)", gr.Number, section=section, onchange=civitai.update_bandwidth_limits))
+    shared.opts.add_option("civitai_download_resume", shared.OptionInfo(True, "Keep partial downloads so they can be resumed", section=section))
+    shared.opts.add_option("civitai_hash_workers", shared.OptionInfo(2, "Files to hash at the same time when new resources are found", gr.Slider, {"minimum": 1, "maximum": 8, "step": 1}, section=section, onchange=on_hash_workers_changed))
+    shared.opts.add_option("civitai_hash_strategy", shared.OptionInfo("buffered", "How files are read for hashing (threaded suits network drives)", gr.Radio, {"choices": hashing.strategies}, section=section))
+    shared.opts.add_option("civitai_tracing", shared.OptionInfo(False, "Record timings of scans, hashing, API calls and downloads (see /civitai/v1/trace)", section=section, onchange=on_tracing_changed))
+    shared.opts.add_option("civitai_watch_folders", shared.OptionInfo(True, "Watch resource folders for changes and keep the resource list up to date (requires restart)", section=section))
     shared.opts.add_option("civitai_folder_model", shared.OptionInfo("", "Models directory (if not default)", section=section))
     shared.opts.add_option("civitai_folder_lora", shared.OptionInfo("", "LoRA directory (if not default)", section=section))
     shared.opts.add_option("civitai_folder_lyco", shared.OptionInfo("", "LyCORIS directory (if not default)", section=section))
@@ -0,0 +1,42 @@
+import gradio as gr
+import os
+from typing import Set
+
+import civitai.lib as civitai
+import civitai.link as link
+import civitai.watcher as watcher
+
+from modules import script_callbacks, shared
+
+folder_watcher = None
+# Files the extension itself writes while downloading, which change every few seconds until the download is done
+transient_suffixes = ('.part', '.part.json', '.tmp', '.preview.download')
+
+def on_folders_changed(paths: Set[str]):
+    paths = {path for path in paths if not path.endswith(transient_suffixes)}
+    if len(paths) == 0: return
+    if watcher.EVERYTHING in paths:
+        types = [type for type, _, _, _ in civitai.get_resource_folders()]
+    else:
+        # Files rewritten in place don't change their directory's mtime, so tell the index where to look
+        for path in paths: civitai.resource_index.invalidate(os.path.dirname(path))
+        types = civitai.get_resource_types_for_paths(list(paths))
+    if len(types) == 0: return
+
+    types = list(dict.fromkeys(types))
+    civitai.log(f"Resource folders changed, refreshing {', '.join(types)}")
+    civitai.load_resource_list(types)
+    if link.is_connected(): link.send_resources()
+
+# Keep the resource list current when models are added or removed outside of the extension
+def start_watcher(demo: gr.Blocks, app):
+    global folder_watcher
+    if not shared.opts.data.get('civitai_watch_folders', True): return
+    if folder_watcher is not None: return
+
+    folders = [folder for _, folder, _, _ in civitai.get_resource_folders()]
+    folder_watcher = watcher.create_watcher(folders, on_folders_changed)
+    folder_watcher.start()
+    civitai.log(f"Watching {len(folder_watcher.folders)} resource folders for changes")
+
+script_callbacks.on_app_started(start_watcher)